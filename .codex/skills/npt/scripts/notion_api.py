@@ -7,29 +7,73 @@ Commands:
   - oauth-exchange: exchange OAuth code for tokens and persist token bundle.
   - oauth-refresh: refresh a stored OAuth token.
   - oauth-token: print a valid access token (auto-refresh when possible).
+  - resolve-workspace: resolve NPT workspace topology + GLOBAL_CONFIG (cached).
   - query-active: exact query against /v1/data_sources/{id}/query.
+  - create-comment: create a page comment via /v1/comments.
+  - export: stream task snapshots to gzip-compressed NDJSON/CSV (resumable).
+  - update-status: set a task page status (direct or via the outbox).
+  - flush: deliver queued outbox comments/status updates with retries.
+  - bench: replay query responses through parse/simplify/group vs a baseline.
+  - tags: incrementally indexed tag vocabulary, usage counts and suggestions.
+  - diff: NDJSON change events against the previous discovery snapshot.
+  - workspace-add / workspace-list / workspace-remove: named workspace registry.
+
+Every command accepts leading `--workspace NAME` (repeatable or comma-separated,
+default $NPT_WORKSPACE) to run against registered workspaces; several
+workspaces run in parallel, each with its own token, connection pool and rate
+budget, and their JSON outputs are combined under `workspaces`. File paths
+given to such a run (export --output, diff --state-path) get the workspace
+name inserted before the suffix so workspaces never share a file; diff keeps
+streaming NDJSON, with a `workspace` field on every event.
+
+Every command accepts a leading `--profile cpu|mem` to write a cProfile or
+tracemalloc report (see `--profile-output`).
 """
 
 from __future__ import annotations
 
 import argparse
 import base64
+import concurrent.futures
+import codecs
+import contextlib
+import cProfile
+import csv
 import datetime as dt
+import dis
+import gzip
+import hashlib
+import http.client
 import http.server
+import io
 import json
 import os
 import pathlib
+import pstats
+import re
 import shutil
+import sqlite3
 import subprocess
 import sys
 import threading
+import time
+import tracemalloc
 import urllib.error
 import urllib.parse
 import urllib.request
 import uuid
 import webbrowser
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+try:
+    import orjson  # optional faster JSON backend
+except ImportError:  # pragma: no cover - depends on environment
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
 
 DEFAULT_NOTION_VERSION = "2025-09-03"
 DEFAULT_INCLUDE_STATUSES = ["待办", "队列中", "进行中", "需要更多信息", "已阻塞"]
@@ -40,19 +84,60 @@ TOKEN_URL = "https://api.notion.com/v1/oauth/token"
 KEYCHAIN_SERVICE = "npt.notion.oauth"
 KEYCHAIN_ACCOUNT = "default"
 DEFAULT_OAUTH_TIMEOUT_SECONDS = 180
+NPT_PAGE_TITLE = "NPT"
+PROJECTS_PAGE_TITLE = "项目"
+SUMMARY_DATABASE_TITLE = "概要"
+IDEA_DATABASE_TITLE = "IDEA"
+CONFIG_DATABASE_TITLE = "配置项"
+CONFIG_VALUE_PROPERTIES = ("Value", "值")
+MAX_TAG_TYPES = 15
+DEFAULT_WORKSPACE_CACHE_MAX_AGE_SECONDS = 24 * 60 * 60
+STREAM_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = " \t\n\r"
+JSON_VALUE_TERMINATORS = JSON_WHITESPACE + ",]}"
+TIMESTAMP_SORT_FIELDS = {"created_time", "last_edited_time"}
+EXPORT_COLUMNS = ["data_source_id", "id", "status", "title", "created_time", "last_edited_time", "tags"]
+EXPORT_FORMATS = ("ndjson", "csv")
+DEFAULT_EXPORT_CHECKPOINT_EVERY = 10
+DEFAULT_RATE_LIMIT = 3.0
+DEFAULT_RATE_BURST = 3.0
+RATE_LIMIT_MARGIN_SECONDS = 0.1
+DEFAULT_OUTBOX_RATE = 3.0
+DEFAULT_OUTBOX_MAX_ATTEMPTS = 8
+DEFAULT_OUTBOX_FLUSH_TIMEOUT_SECONDS = 600
+OUTBOX_MAX_BACKOFF_SECONDS = 300
+DEFAULT_TAG_SUGGESTIONS = 5
+TAG_INDEX_SKEW_SECONDS = 120
+DEFAULT_TAG_INDEX_RECONCILE_SECONDS = 6 * 60 * 60
+PROFILE_MODES = ("cpu", "mem")
+PROFILE_TOP_N = 25
+DEFAULT_BENCH_PAGES = 2000
+DEFAULT_BENCH_REPEAT = 5
+DEFAULT_BENCH_TOLERANCE = 0.25
+SORT_DIRECTIONS = {
+    "asc": "ascending",
+    "ascending": "ascending",
+    "desc": "descending",
+    "descending": "descending",
+}
 
 
 class NptError(Exception):
     """User-facing, non-stacktrace error."""
 
 
+class NetworkError(NptError):
+    """Connection-level failure before any HTTP response; safe to retry."""
+
+
 class HttpError(Exception):
     """HTTP error wrapper with response details."""
 
-    def __init__(self, status: int, body: str):
+    def __init__(self, status: int, body: str, retry_after: Optional[float] = None):
         super().__init__(f"HTTP {status}: {body}")
         self.status = status
         self.body = body
+        self.retry_after = retry_after
 
 
 def utc_now() -> dt.datetime:
@@ -106,6 +191,34 @@ def command_exists(name: str) -> bool:
     return shutil.which(name) is not None
 
 
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path, blocking: bool = True, timeout: Optional[float] = None) -> Iterator[bool]:
+    """Hold an exclusive advisory lock on `path`; yields False if it could not be taken.
+
+    Non-blocking callers give up at once; `timeout` bounds a blocking wait.
+    """
+    ensure_parent(path)
+    with open(path, "a+") as handle:
+        if fcntl is None:
+            yield True
+            return
+        deadline = time.monotonic() + timeout if blocking and timeout is not None else None
+        while True:
+            flags = fcntl.LOCK_EX if blocking and deadline is None else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(handle.fileno(), flags)
+                break
+            except BlockingIOError:
+                if deadline is None or time.monotonic() >= deadline:
+                    yield False
+                    return
+                time.sleep(0.2)
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
 def choose_store_mode() -> str:
     requested = (os.getenv("NPT_TOKEN_STORE") or "auto").strip().lower()
     if requested not in {"auto", "file", "keychain"}:
@@ -121,15 +234,43 @@ def choose_store_mode() -> str:
     return "file"
 
 
+def npt_config_dir() -> pathlib.Path:
+    return pathlib.Path(os.getenv("NPT_CONFIG_DIR", "~/.config/npt")).expanduser()
+
+
+def token_fingerprint(access_token: str) -> str:
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
+
+
+def validate_workspace_name(name: str) -> str:
+    cleaned = name.strip()
+    if not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}", cleaned):
+        raise NptError(f"Invalid workspace name {name!r}; use letters, digits, '.', '_' or '-'")
+    return cleaned
+
+
+def workspace_dir(workspace: str) -> pathlib.Path:
+    return npt_config_dir() / "workspaces" / workspace
+
+
 class TokenStore:
-    def __init__(self) -> None:
-        config_dir = pathlib.Path(os.getenv("NPT_CONFIG_DIR", "~/.config/npt")).expanduser()
-        self.token_path = pathlib.Path(
-            os.getenv("NPT_OAUTH_TOKEN_PATH", str(config_dir / "notion-oauth.json"))
-        ).expanduser()
-        self.state_path = pathlib.Path(
-            os.getenv("NPT_OAUTH_STATE_PATH", str(config_dir / "notion-oauth-state.json"))
-        ).expanduser()
+    def __init__(self, workspace: Optional[str] = None) -> None:
+        self.workspace = workspace
+        self.keychain_account = KEYCHAIN_ACCOUNT
+        if workspace:
+            # Named workspaces never share the default slot or its env overrides.
+            base_dir = workspace_dir(workspace)
+            self.token_path = base_dir / "notion-oauth.json"
+            self.state_path = base_dir / "notion-oauth-state.json"
+            self.keychain_account = f"workspace:{workspace}"
+        else:
+            config_dir = npt_config_dir()
+            self.token_path = pathlib.Path(
+                os.getenv("NPT_OAUTH_TOKEN_PATH", str(config_dir / "notion-oauth.json"))
+            ).expanduser()
+            self.state_path = pathlib.Path(
+                os.getenv("NPT_OAUTH_STATE_PATH", str(config_dir / "notion-oauth-state.json"))
+            ).expanduser()
         self.mode = choose_store_mode()
 
     def save_state(self, state: str, redirect_uri: str) -> None:
@@ -162,7 +303,7 @@ class TokenStore:
                 "-s",
                 KEYCHAIN_SERVICE,
                 "-a",
-                KEYCHAIN_ACCOUNT,
+                self.keychain_account,
                 "-w",
             ],
             capture_output=True,
@@ -188,7 +329,7 @@ class TokenStore:
                 "-s",
                 KEYCHAIN_SERVICE,
                 "-a",
-                KEYCHAIN_ACCOUNT,
+                self.keychain_account,
                 "-w",
                 payload,
             ],
@@ -215,12 +356,333 @@ def get_oauth_credentials(redirect_override: Optional[str] = None) -> Tuple[str,
     return client_id.strip(), client_secret.strip(), redirect_uri.strip()
 
 
-def request_json(
-    method: str,
-    url: str,
-    headers: Optional[Dict[str, str]] = None,
-    body: Optional[Dict[str, Any]] = None,
-) -> Dict[str, Any]:
+class RateLimiter:
+    """Host-wide token bucket shared by every NPT process using the same token.
+
+    The bucket lives in a small JSON state file guarded by an advisory lock.
+    Each call reserves one token (the balance may go negative) and sleeps
+    outside the lock until its reservation matures, so concurrent processes
+    are paced in arrival order at `rate` requests per second overall.
+    """
+
+    def __init__(self, key: str, rate: float, burst: float):
+        base_dir = pathlib.Path(
+            os.getenv("NPT_RATE_LIMIT_DIR", str(npt_config_dir() / "rate-limit"))
+        ).expanduser()
+        self.state_path = base_dir / f"{key}.json"
+        self.lock_path = base_dir / f"{key}.lock"
+        self.rate = rate
+        self.burst = max(1.0, burst)
+
+    def _load(self, now: float) -> float:
+        try:
+            state = read_json_file(self.state_path) or {}
+        except NptError:
+            state = {}
+        tokens = float(state.get("tokens", self.burst))
+        updated = float(state.get("updated", now))
+        return min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+
+    def _adjust(self, delta: float) -> float:
+        with file_lock(self.lock_path):
+            now = time.time()
+            tokens = self._load(now) + delta
+            write_json_file(self.state_path, {"tokens": tokens, "updated": now}, secure=True)
+        return tokens
+
+    def acquire(self) -> float:
+        tokens = self._adjust(-1.0)
+        wait = -tokens / self.rate if tokens < 0 else 0.0
+        if wait > 0:
+            # The server's bucket sees arrival times, not reservation times; a
+            # short margin keeps send jitter from landing ahead of its refill.
+            wait += RATE_LIMIT_MARGIN_SECONDS
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, seconds: float) -> None:
+        """Push every process back after the server signalled 429."""
+        with file_lock(self.lock_path):
+            now = time.time()
+            tokens = min(self._load(now), 0.0) - seconds * self.rate
+            write_json_file(self.state_path, {"tokens": tokens, "updated": now}, secure=True)
+
+
+def rate_limit_settings(entry: Optional[Dict[str, Any]] = None) -> Tuple[float, float]:
+    """(rate, burst) from a workspace registry entry, else NPT_RATE_LIMIT / NPT_RATE_BURST."""
+    entry = entry or {}
+    try:
+        rate = float(entry.get("rate_limit", os.getenv("NPT_RATE_LIMIT") or DEFAULT_RATE_LIMIT))
+        burst = float(entry.get("rate_burst", os.getenv("NPT_RATE_BURST") or DEFAULT_RATE_BURST))
+    except (TypeError, ValueError) as exc:
+        raise NptError("NPT_RATE_LIMIT and NPT_RATE_BURST must be numbers") from exc
+    return rate, burst
+
+
+def rate_limiter_for(headers: Optional[Dict[str, str]]) -> Optional[RateLimiter]:
+    rate, burst = rate_limit_settings()
+    authorization = (headers or {}).get("Authorization", "")
+    if rate <= 0 or not authorization.startswith("Bearer "):
+        return None
+    return RateLimiter(token_fingerprint(authorization[len("Bearer ") :]), rate, burst)
+
+
+def retry_after_seconds(headers: Any) -> float:
+    try:
+        return max(1.0, float(headers.get("Retry-After", "1")))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections reused across the requests of one workspace."""
+
+    def __init__(self, max_idle: int = 4):
+        self.max_idle = max_idle
+        self._idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, key: Tuple[str, str, int]) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port), False
+        return http.client.HTTPConnection(host, port), False
+
+    def _release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+    @contextlib.contextmanager
+    def open(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        payload: Optional[bytes],
+    ) -> Iterator[http.client.HTTPResponse]:
+        parsed = urllib.parse.urlparse(url)
+        scheme = parsed.scheme or "https"
+        key = (scheme, parsed.hostname or "", parsed.port or (443 if scheme == "https" else 80))
+        path = parsed.path or "/"
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                resp = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as exc:
+                conn.close()
+                # The server dropped an idle keep-alive connection; retry on a fresh one.
+                if reused:
+                    continue
+                raise NetworkError(f"Network error: {exc}") from exc
+            except (OSError, http.client.HTTPException) as exc:
+                conn.close()
+                raise NetworkError(f"Network error: {exc}") from exc
+        if resp.status >= 400:
+            err_body = resp.read().decode("utf-8", errors="replace")
+            self._release(key, conn)
+            raise HttpError(resp.status, err_body, retry_after_seconds(resp.headers))
+        try:
+            yield resp
+        except BaseException:
+            conn.close()
+            raise
+        if resp.isclosed() and not resp.will_close:
+            self._release(key, conn)
+        else:
+            conn.close()
+
+
+class WorkspaceSession:
+    """Credentials, connection pool and rate budget for one named workspace."""
+
+    def __init__(self, name: str, access_token: str, source: str, rate: float, burst: float):
+        self.name = name
+        self.access_token = access_token
+        self.source = source
+        self.pool = ConnectionPool()
+        self.limiter = RateLimiter(token_fingerprint(access_token), rate, burst) if rate > 0 else None
+
+
+WORKSPACE_CONTEXT = threading.local()
+
+
+def active_workspace() -> Optional[WorkspaceSession]:
+    return getattr(WORKSPACE_CONTEXT, "session", None)
+
+
+@contextlib.contextmanager
+def workspace_context(session: Optional[WorkspaceSession]) -> Iterator[None]:
+    previous = active_workspace()
+    WORKSPACE_CONTEXT.session = session
+    try:
+        yield
+    finally:
+        WORKSPACE_CONTEXT.session = previous
+        if session is not None:
+            session.pool.close()
+
+
+def workspace_data_dir() -> pathlib.Path:
+    """Per-workspace state directory (caches, outbox); the config dir by default."""
+    session = active_workspace()
+    if session is None:
+        return npt_config_dir()
+    return workspace_dir(session.name)
+
+
+def choose_json_backend() -> str:
+    requested = (os.getenv("NPT_JSON_BACKEND") or "auto").strip().lower()
+    if requested not in {"auto", "orjson", "stdlib"}:
+        raise NptError("NPT_JSON_BACKEND must be one of: auto, orjson, stdlib")
+    if requested == "orjson" and orjson is None:
+        raise NptError("NPT_JSON_BACKEND=orjson requires the orjson package")
+    if requested == "stdlib" or orjson is None:
+        return "stdlib"
+    return "orjson"
+
+
+def json_loads(data: bytes) -> Any:
+    """Parse JSON straight from bytes without an intermediate str copy when possible."""
+    if choose_json_backend() == "orjson":
+        return orjson.loads(data)  # orjson.JSONDecodeError subclasses json.JSONDecodeError
+    return json.loads(data)
+
+
+class JsonStreamReader:
+    """Incrementally decoded text window over a byte stream.
+
+    Only the unconsumed tail of the stream is kept in memory, so parsing one
+    value at a time holds at most one value plus one (growing) read chunk.
+    """
+
+    def __init__(self, read: Callable[[int], bytes], chunk_size: int = STREAM_CHUNK_SIZE):
+        self._read = read
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size: Optional[int] = None) -> bool:
+        if self.eof:
+            return False
+        chunk = self._read(size or self._chunk_size)
+        if not chunk:
+            self.eof = True
+            decoded = self._decoder.decode(b"", final=True)
+        else:
+            decoded = self._decoder.decode(chunk)
+        self.text = self.text[self.pos :] + decoded
+        self.pos = 0
+        return True
+
+    def error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self.text, self.pos)
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise self.error("Unexpected end of JSON stream")
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self.error(f"Expected {char!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        # Each failed attempt re-parses the pending item from its start; doubling
+        # the read keeps the total work linear in the item size.
+        read_size = self._chunk_size
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.text, self.pos)
+                # A number cut at the buffer edge ("1", "0.", "1e+") decodes as a shorter
+                # number; only trust it once the character after it is a delimiter.
+                number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                complete = end < len(self.text) and (not number or self.text[end] in JSON_VALUE_TERMINATORS)
+                if complete or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(read_size)
+            read_size *= 2
+
+
+def iter_json_results(
+    read: Callable[[int], bytes],
+    envelope: Dict[str, Any],
+    array_key: str = "results",
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[Any]:
+    """Yield items of the top-level `array_key` list while the body streams in.
+
+    All other top-level keys (`has_more`, `next_cursor`, ...) are stored in
+    `envelope`; they are complete once the generator is exhausted.
+    """
+    reader = JsonStreamReader(read, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise reader.error("Expected object key")
+        reader.expect(":")
+        if key == array_key and reader.peek() == "[":
+            reader.pos += 1
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    separator = reader.peek()
+                    reader.pos += 1
+                    if separator == "]":
+                        break
+                    if separator != ",":
+                        raise reader.error("Expected ',' or ']'")
+        else:
+            envelope[key] = reader.value()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise reader.error("Expected ',' or '}'")
+
+
+def encode_request(
+    headers: Optional[Dict[str, str]],
+    body: Optional[Dict[str, Any]],
+) -> Tuple[Dict[str, str], Optional[bytes]]:
     payload = None
     merged_headers: Dict[str, str] = {"Accept": "application/json"}
     if headers:
@@ -228,18 +690,75 @@ def request_json(
     if body is not None:
         payload = json.dumps(body).encode("utf-8")
         merged_headers.setdefault("Content-Type", "application/json")
-    request = urllib.request.Request(url=url, data=payload, headers=merged_headers, method=method)
+    return merged_headers, payload
+
+
+@contextlib.contextmanager
+def open_response(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]],
+    body: Optional[Dict[str, Any]],
+) -> Iterator[Any]:
+    """Rate-limit, send and open a response; errors become HttpError/NptError.
+
+    Inside an active workspace the request goes through that workspace's
+    keep-alive pool and rate budget; otherwise a one-shot urllib request is used.
+    """
+    merged_headers, payload = encode_request(headers, body)
+    session = active_workspace()
+    limiter = session.limiter if session is not None else rate_limiter_for(headers)
+    if limiter is not None:
+        limiter.acquire()
+    try:
+        if session is not None:
+            with session.pool.open(method, url, merged_headers, payload) as resp:
+                yield resp
+            return
+        request = urllib.request.Request(url=url, data=payload, headers=merged_headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as resp:
+                yield resp
+        except urllib.error.HTTPError as exc:
+            err_body = exc.read().decode("utf-8")
+            raise HttpError(exc.code, err_body, retry_after_seconds(exc.headers)) from exc
+        except urllib.error.URLError as exc:
+            raise NetworkError(f"Network error: {exc}") from exc
+    except HttpError as exc:
+        if exc.status == 429 and limiter is not None:
+            limiter.penalize(exc.retry_after or 1.0)
+        raise
+
+
+def request_json(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    body: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
     try:
-        with urllib.request.urlopen(request) as resp:
-            raw = resp.read().decode("utf-8")
+        with open_response(method, url, headers, body) as resp:
+            raw = resp.read()
             if not raw:
                 return {}
-            return json.loads(raw)
-    except urllib.error.HTTPError as exc:
-        err_body = exc.read().decode("utf-8")
-        raise HttpError(exc.code, err_body) from exc
-    except urllib.error.URLError as exc:
-        raise NptError(f"Network error: {exc}") from exc
+            return json_loads(raw)
+    except json.JSONDecodeError as exc:
+        raise NptError(f"Invalid JSON response from {url}: {exc}") from exc
+
+
+def request_json_stream(
+    method: str,
+    url: str,
+    envelope: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    body: Optional[Dict[str, Any]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Like request_json, but yields `results` items one by one as they arrive."""
+    try:
+        with open_response(method, url, headers, body) as resp:
+            for item in iter_json_results(resp.read, envelope):
+                if isinstance(item, dict):
+                    yield item
     except json.JSONDecodeError as exc:
         raise NptError(f"Invalid JSON response from {url}: {exc}") from exc
 
@@ -473,41 +992,466 @@ def simplify_page(page: Dict[str, Any], status_property: str, title_property: st
     }
 
 
-def query_data_source(
-    access_token: str,
-    notion_version: str,
+def extract_multi_select(page: Dict[str, Any], prop_name: str) -> List[str]:
+    props = page.get("properties", {})
+    if not isinstance(props, dict):
+        return []
+    node = props.get(prop_name)
+    if not isinstance(node, dict) or not isinstance(node.get("multi_select"), list):
+        return []
+    return [str(item["name"]) for item in node["multi_select"] if isinstance(item, dict) and item.get("name")]
+
+
+def export_row(
+    page: Dict[str, Any],
     data_source_id: str,
     status_property: str,
-    include_statuses: List[str],
-    page_size: int,
-) -> List[Dict[str, Any]]:
-    endpoint = f"https://api.notion.com/v1/data_sources/{data_source_id}/query"
-    headers = {
+    title_property: str,
+    tags_property: str,
+) -> Dict[str, Any]:
+    return {
+        "data_source_id": data_source_id,
+        "id": page.get("id", ""),
+        "status": extract_status(page, status_property),
+        "title": extract_title(page, title_property),
+        "created_time": page.get("created_time", ""),
+        "last_edited_time": page.get("last_edited_time", ""),
+        "tags": extract_multi_select(page, tags_property),
+    }
+
+
+def notion_headers(access_token: str, notion_version: str) -> Dict[str, str]:
+    return {
         "Authorization": f"Bearer {access_token}",
         "Notion-Version": notion_version,
         "Content-Type": "application/json",
     }
-    filter_or = [{"property": status_property, "select": {"equals": value}} for value in include_statuses]
-    pages: List[Dict[str, Any]] = []
-    cursor: Optional[str] = None
+
+
+def iter_data_source_pages(
+    access_token: str,
+    notion_version: str,
+    data_source_id: str,
+    page_size: int,
+    query_filter: Optional[Dict[str, Any]] = None,
+    sorts: Optional[List[Dict[str, Any]]] = None,
+    stream: bool = False,
+    stop_when: Optional[Callable[[], bool]] = None,
+    state: Optional[Dict[str, Any]] = None,
+    start_cursor: Optional[str] = None,
+    on_page_end: Optional[Callable[[Optional[str]], None]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield pages across all result pages.
+
+    `stop_when` is checked before each follow-up request; when it returns True
+    pagination stops and `state["truncated"]` is set if more results remained.
+    `on_page_end` receives the next cursor (None on the last page) after every
+    result page has been fully yielded.
+    """
+    endpoint = f"https://api.notion.com/v1/data_sources/{data_source_id}/query"
+    headers = notion_headers(access_token, notion_version)
+    cursor: Optional[str] = start_cursor
     while True:
-        body: Dict[str, Any] = {
-            "page_size": page_size,
-            "result_type": "page",
-            "filter": {"or": filter_or},
-        }
+        body: Dict[str, Any] = {"page_size": page_size, "result_type": "page"}
+        if query_filter:
+            body["filter"] = query_filter
+        if sorts:
+            body["sorts"] = sorts
         if cursor:
             body["start_cursor"] = cursor
-        response = request_json("POST", endpoint, headers=headers, body=body)
-        results = response.get("results", [])
-        if isinstance(results, list):
-            pages.extend([item for item in results if isinstance(item, dict)])
+        if stream:
+            response: Dict[str, Any] = {}
+            yield from request_json_stream("POST", endpoint, response, headers=headers, body=body)
+        else:
+            response = request_json("POST", endpoint, headers=headers, body=body)
+            results = response.get("results", [])
+            if isinstance(results, list):
+                for item in results:
+                    if isinstance(item, dict):
+                        yield item
         has_more = bool(response.get("has_more"))
         next_cursor = response.get("next_cursor")
+        if on_page_end is not None:
+            on_page_end(str(next_cursor) if has_more and next_cursor else None)
         if not has_more or not next_cursor:
             break
+        if stop_when is not None and stop_when():
+            if state is not None:
+                state["truncated"] = True
+            break
+        cursor = str(next_cursor)
+
+
+def parse_sort_spec(spec: str) -> Dict[str, Any]:
+    # Property names may contain ':'; only a recognised suffix is a direction.
+    field, _, direction = spec.rpartition(":")
+    normalized = SORT_DIRECTIONS.get(direction.strip().lower())
+    if not field or normalized is None:
+        field, normalized = spec, SORT_DIRECTIONS["asc"]
+    field = field.strip()
+    if not field:
+        raise NptError(f"Invalid --sort value {spec!r}; expected <field>[:asc|desc]")
+    if field in TIMESTAMP_SORT_FIELDS:
+        return {"timestamp": field, "direction": normalized}
+    return {"property": field, "direction": normalized}
+
+
+def group_pages(
+    simplified: List[Dict[str, Any]],
+    active_statuses: List[str],
+    blocked_status: str,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
+    active_set = set(active_statuses)
+    active = [item for item in simplified if item.get("status") in active_set]
+    blocked = [item for item in simplified if item.get("status") == blocked_status]
+    skipped = len(simplified) - len(active) - len(blocked)
+    return active, blocked, skipped
+
+
+def status_filter(status_property: str, statuses: List[str]) -> Dict[str, Any]:
+    return {"or": [{"property": status_property, "select": {"equals": value}} for value in statuses]}
+
+
+def iter_paginated(
+    method: str,
+    url: str,
+    headers: Dict[str, str],
+    body: Optional[Dict[str, Any]] = None,
+) -> Iterator[Dict[str, Any]]:
+    cursor: Optional[str] = None
+    while True:
+        request_body = dict(body) if body is not None else None
+        request_url = url
+        if cursor and request_body is not None:
+            request_body["start_cursor"] = cursor
+        elif cursor:
+            separator = "&" if "?" in url else "?"
+            request_url = f"{url}{separator}{urllib.parse.urlencode({'start_cursor': cursor})}"
+        response = request_json(method, request_url, headers=headers, body=request_body)
+        results = response.get("results", [])
+        if isinstance(results, list):
+            for item in results:
+                if isinstance(item, dict):
+                    yield item
+        next_cursor = response.get("next_cursor")
+        if not response.get("has_more") or not next_cursor:
+            break
         cursor = str(next_cursor)
-    return pages
+
+
+def search_objects(
+    access_token: str,
+    notion_version: str,
+    query: str,
+    object_type: str,
+) -> List[Dict[str, Any]]:
+    body = {
+        "query": query,
+        "filter": {"property": "object", "value": object_type},
+        "page_size": 100,
+    }
+    return list(
+        iter_paginated(
+            "POST",
+            "https://api.notion.com/v1/search",
+            headers=notion_headers(access_token, notion_version),
+            body=body,
+        )
+    )
+
+
+def list_block_children(access_token: str, notion_version: str, block_id: str) -> List[Dict[str, Any]]:
+    return list(
+        iter_paginated(
+            "GET",
+            f"https://api.notion.com/v1/blocks/{block_id}/children?page_size=100",
+            headers=notion_headers(access_token, notion_version),
+        )
+    )
+
+
+def retrieve_database(access_token: str, notion_version: str, database_id: str) -> Dict[str, Any]:
+    endpoint = f"https://api.notion.com/v1/databases/{database_id}"
+    return request_json("GET", endpoint, headers=notion_headers(access_token, notion_version))
+
+
+def object_title(obj: Dict[str, Any]) -> str:
+    title = obj.get("title")
+    if isinstance(title, list):
+        return flatten_text(title)
+    if obj.get("object") == "page":
+        text = extract_title(obj, "title")
+        return "" if text == "(untitled)" else text
+    return ""
+
+
+def is_workspace_root(obj: Dict[str, Any]) -> bool:
+    for key in ("parent", "database_parent"):
+        parent = obj.get(key)
+        if isinstance(parent, dict) and parent.get("type") == "workspace":
+            return True
+    return False
+
+
+def find_root_object(
+    access_token: str,
+    notion_version: str,
+    title: str,
+    object_type: str,
+) -> Optional[Dict[str, Any]]:
+    candidates = [
+        item
+        for item in search_objects(access_token, notion_version, title, object_type)
+        if object_title(item) == title and not item.get("in_trash") and not item.get("archived")
+    ]
+    for item in candidates:
+        if is_workspace_root(item):
+            return item
+    return candidates[0] if candidates else None
+
+
+def find_child_database(
+    access_token: str,
+    notion_version: str,
+    page_id: str,
+    title: str,
+) -> Optional[Dict[str, Any]]:
+    for block in list_block_children(access_token, notion_version, page_id):
+        if block.get("type") != "child_database":
+            continue
+        child = block.get("child_database", {})
+        if isinstance(child, dict) and str(child.get("title", "")).strip() == title:
+            return retrieve_database(access_token, notion_version, str(block.get("id", "")))
+    return None
+
+
+def parent_database_id(data_source: Dict[str, Any]) -> str:
+    parent = data_source.get("parent", {})
+    if isinstance(parent, dict):
+        return str(parent.get("database_id", ""))
+    return ""
+
+
+def first_data_source_id(database: Dict[str, Any]) -> str:
+    sources = database.get("data_sources")
+    if isinstance(sources, list):
+        for source in sources:
+            if isinstance(source, dict) and source.get("id"):
+                return str(source["id"])
+    return ""
+
+
+def extract_plain_property(node: Dict[str, Any]) -> str:
+    kind = node.get("type")
+    value = node.get(kind) if isinstance(kind, str) else None
+    if isinstance(value, list):
+        if kind == "multi_select":
+            return ",".join(str(item.get("name", "")) for item in value if isinstance(item, dict))
+        return flatten_text(value)
+    if isinstance(value, dict):
+        return str(value.get("name", ""))
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return ""
+    return str(value)
+
+
+def parse_config_rows(pages: List[Dict[str, Any]]) -> Dict[str, str]:
+    config: Dict[str, str] = {}
+    for page in pages:
+        props = page.get("properties", {})
+        if not isinstance(props, dict):
+            continue
+        key = ""
+        value: Optional[str] = None
+        fallback: Optional[str] = None
+        for name, node in props.items():
+            if not isinstance(node, dict):
+                continue
+            if node.get("type") == "title":
+                key = extract_plain_property(node)
+            elif name in CONFIG_VALUE_PROPERTIES:
+                value = extract_plain_property(node)
+            elif fallback is None:
+                fallback = extract_plain_property(node)
+        if key:
+            config[key] = (value if value is not None else fallback or "").strip()
+    return config
+
+
+def parse_bool(value: str) -> Optional[bool]:
+    lowered = value.strip().lower()
+    if lowered in {"true", "yes", "on", "1", "是", "开"}:
+        return True
+    if lowered in {"false", "no", "off", "0", "否", "关"}:
+        return False
+    return None
+
+
+def normalize_global_config(raw: Dict[str, str]) -> Tuple[Dict[str, Any], List[str]]:
+    warnings: List[str] = []
+    config: Dict[str, Any] = {
+        "language": raw.get("language", "").strip(),
+        "auto_mode": False,
+        "max_tags": MAX_TAG_TYPES,
+        "session_log": True,
+        "result_method": "comment",
+    }
+    for key in ("auto_mode", "session_log"):
+        if raw.get(key):
+            parsed = parse_bool(raw[key])
+            if parsed is None:
+                warnings.append(f"Ignoring invalid {key} value: {raw[key]!r}")
+            else:
+                config[key] = parsed
+    if raw.get("max_tags"):
+        try:
+            config["max_tags"] = max(1, min(MAX_TAG_TYPES, int(raw["max_tags"])))
+        except ValueError:
+            warnings.append(f"Ignoring invalid max_tags value: {raw['max_tags']!r}")
+    result_method = raw.get("result_method", "").strip()
+    if result_method and result_method != "comment":
+        warnings.append(f"result_method {result_method!r} is not supported; forcing comment")
+    return config, warnings
+
+
+def config_marker(pages: List[Dict[str, Any]]) -> str:
+    """Digest of every config row, so deletions and same-minute edits are visible."""
+    rows = sorted(
+        (str(page.get("id", "")), str(page.get("last_edited_time", "")), page.get("properties", {}))
+        for page in pages
+        if isinstance(page, dict)
+    )
+    if not rows:
+        return ""
+    encoded = json.dumps(rows, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+def fetch_config_rows(access_token: str, notion_version: str, config_data_source_id: str) -> List[Dict[str, Any]]:
+    return list(
+        iter_data_source_pages(
+            access_token=access_token,
+            notion_version=notion_version,
+            data_source_id=config_data_source_id,
+            page_size=100,
+            sorts=[{"timestamp": "last_edited_time", "direction": "descending"}],
+        )
+    )
+
+
+def resolve_workspace_topology(access_token: str, notion_version: str) -> Dict[str, str]:
+    npt_page = find_root_object(access_token, notion_version, NPT_PAGE_TITLE, "page")
+    if not npt_page:
+        raise NptError(
+            "NPT page not found. Run Phase A validation (npt init) or share the NPT page with the integration."
+        )
+    projects_page = find_root_object(access_token, notion_version, PROJECTS_PAGE_TITLE, "page")
+    summary = find_root_object(access_token, notion_version, SUMMARY_DATABASE_TITLE, "data_source")
+    idea = find_root_object(access_token, notion_version, IDEA_DATABASE_TITLE, "data_source")
+    missing = [
+        name
+        for name, obj in (
+            (PROJECTS_PAGE_TITLE, projects_page),
+            (SUMMARY_DATABASE_TITLE, summary),
+            (IDEA_DATABASE_TITLE, idea),
+        )
+        if not obj
+    ]
+    if missing:
+        raise NptError(f"NPT workspace is incomplete; missing root items: {', '.join(missing)}")
+    npt_page_id = str(npt_page.get("id", ""))
+    config_db = find_child_database(access_token, notion_version, npt_page_id, CONFIG_DATABASE_TITLE) or {}
+    projects_page = projects_page or {}
+    summary = summary or {}
+    idea = idea or {}
+    return {
+        "npt_page_id": npt_page_id,
+        "projects_page_id": str(projects_page.get("id", "")),
+        "summary_database_id": parent_database_id(summary),
+        "summary_data_source_id": str(summary.get("id", "")),
+        "idea_database_id": parent_database_id(idea),
+        "idea_data_source_id": str(idea.get("id", "")),
+        "config_database_id": str(config_db.get("id", "")),
+        "config_data_source_id": first_data_source_id(config_db),
+    }
+
+
+def workspace_cache_path() -> pathlib.Path:
+    if active_workspace() is not None:
+        return workspace_data_dir() / "workspace-cache.json"
+    return pathlib.Path(
+        os.getenv("NPT_WORKSPACE_CACHE_PATH", str(npt_config_dir() / "workspace-cache.json"))
+    ).expanduser()
+
+
+def resolve_workspace(
+    access_token: str,
+    notion_version: str,
+    max_age_seconds: int = DEFAULT_WORKSPACE_CACHE_MAX_AGE_SECONDS,
+    force_refresh: bool = False,
+) -> Dict[str, Any]:
+    cache_path = workspace_cache_path()
+    fingerprint = token_fingerprint(access_token)
+    cached = read_json_file(cache_path)
+    cache_state = "miss"
+    topology: Optional[Dict[str, str]] = None
+    rows: List[Dict[str, Any]] = []
+    resolved_at = to_iso_z(utc_now())
+    if cached and not force_refresh:
+        cached_resolved_at = parse_iso(str(cached.get("resolved_at", "")))
+        fresh = cached_resolved_at is not None and utc_now() - cached_resolved_at < dt.timedelta(
+            seconds=max_age_seconds
+        )
+        same_owner = cached.get("token_fingerprint") == fingerprint
+        same_version = cached.get("notion_version") == notion_version
+        cached_topology = cached.get("workspace", {})
+        cache_state = "stale"
+        if fresh and same_owner and same_version and isinstance(cached_topology, dict):
+            topology = cached_topology
+            if topology.get("config_data_source_id"):
+                try:
+                    rows = fetch_config_rows(access_token, notion_version, topology["config_data_source_id"])
+                except HttpError as exc:
+                    if exc.status not in {400, 404}:
+                        raise
+                    # The config database moved or was removed; re-resolve everything.
+                    topology = None
+            if topology is not None:
+                if config_marker(rows) == cached.get("config_marker", ""):
+                    out = dict(cached)
+                    out["cache"] = "hit"
+                    return out
+                # Only config values changed: keep the topology, reuse the probed rows.
+                cache_state = "config"
+                resolved_at = str(cached.get("resolved_at", resolved_at))
+    elif force_refresh:
+        cache_state = "refresh"
+
+    if topology is None:
+        topology = resolve_workspace_topology(access_token, notion_version)
+        if topology.get("config_data_source_id"):
+            rows = fetch_config_rows(access_token, notion_version, topology["config_data_source_id"])
+    raw_config = parse_config_rows(rows)
+    global_config, warnings = normalize_global_config(raw_config)
+    if not topology.get("config_data_source_id"):
+        warnings.append(f"{CONFIG_DATABASE_TITLE} database not found under NPT page; using defaults")
+    payload: Dict[str, Any] = {
+        # Topology age: a config-only refresh keeps it, so --max-age still bounds the search results.
+        "resolved_at": resolved_at,
+        "token_fingerprint": fingerprint,
+        "notion_version": notion_version,
+        "config_marker": config_marker(rows),
+        "workspace": topology,
+        "raw_config": raw_config,
+        "global_config": global_config,
+        "warnings": warnings,
+    }
+    write_json_file(cache_path, payload, secure=True)
+    out = dict(payload)
+    out["cache"] = cache_state
+    return out
 
 
 def split_text_chunks(text: str, max_chars: int = 1800) -> List[str]:
@@ -536,11 +1480,7 @@ def create_page_comment(
     text: str,
 ) -> Dict[str, Any]:
     endpoint = "https://api.notion.com/v1/comments"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Notion-Version": notion_version,
-        "Content-Type": "application/json",
-    }
+    headers = notion_headers(access_token, notion_version)
     body = {
         "parent": {"page_id": page_id},
         "rich_text": build_comment_rich_text(text),
@@ -548,41 +1488,833 @@ def create_page_comment(
     return request_json("POST", endpoint, headers=headers, body=body)
 
 
-def maybe_refresh_store_token(store: TokenStore, token_bundle: Dict[str, Any]) -> Dict[str, Any]:
-    if not token_expiring_soon(token_bundle):
-        return token_bundle
-    refresh = token_bundle.get("refresh_token")
-    if not refresh:
-        return token_bundle
-    client_id, client_secret, _ = get_oauth_credentials()
-    refreshed = refresh_token(client_id, client_secret, str(refresh))
-    if "refresh_token" not in refreshed:
-        refreshed["refresh_token"] = refresh
-    store.save_token(refreshed)
-    return refreshed
+def update_page_status(
+    access_token: str,
+    notion_version: str,
+    page_id: str,
+    status_property: str,
+    status: str,
+) -> Dict[str, Any]:
+    endpoint = f"https://api.notion.com/v1/pages/{page_id}"
+    body = {"properties": {status_property: {"select": {"name": status}}}}
+    return request_json("PATCH", endpoint, headers=notion_headers(access_token, notion_version), body=body)
 
 
-def resolve_query_token(
-    store: TokenStore,
-    explicit_token: Optional[str],
-) -> Tuple[str, str, Optional[Dict[str, Any]]]:
-    if explicit_token:
-        return explicit_token, "explicit_token", None
-    api_key = os.getenv("NOTION_API_KEY")
-    if api_key:
-        return api_key, "notion_api_key", None
-    raise NptError(
-        "No query token found. Set NOTION_API_KEY."
-    )
+def find_delivered_comment(
+    access_token: str,
+    notion_version: str,
+    page_id: str,
+    text: str,
+    not_before: Optional[dt.datetime],
+) -> Optional[Dict[str, Any]]:
+    expected = text.replace("\r\n", "\n").strip()
+    endpoint = f"https://api.notion.com/v1/comments?{urllib.parse.urlencode({'block_id': page_id, 'page_size': 100})}"
+    for comment in iter_paginated("GET", endpoint, headers=notion_headers(access_token, notion_version)):
+        created = parse_iso(str(comment.get("created_time", "")))
+        if not_before is not None and created is not None and created < not_before:
+            continue
+        rich = comment.get("rich_text")
+        if isinstance(rich, list) and flatten_text(rich) == expected:
+            return comment
+    return None
 
 
-def cmd_oauth_start(args: argparse.Namespace, store: TokenStore) -> None:
-    owner = args.owner or "user"
-    if owner not in {"user", "workspace"}:
-        raise NptError("--owner must be user or workspace")
-    client_id, _, redirect_uri = get_oauth_credentials(args.redirect_uri)
-    state = args.state or uuid.uuid4().hex
-    auth_url = build_auth_url(client_id, redirect_uri, state, owner)
+class Outbox:
+    """Durable local queue of Notion writes (SQLite, one row per write)."""
+
+    def __init__(self) -> None:
+        if active_workspace() is not None:
+            self.path = workspace_data_dir() / "outbox.sqlite3"
+        else:
+            self.path = pathlib.Path(
+                os.getenv("NPT_OUTBOX_PATH", str(npt_config_dir() / "outbox.sqlite3"))
+            ).expanduser()
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        ensure_parent(self.path)
+        self.conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                notion_version TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT NOT NULL DEFAULT '',
+                enqueued_at TEXT NOT NULL,
+                next_attempt_at TEXT NOT NULL,
+                delivered_at TEXT NOT NULL DEFAULT '',
+                result_id TEXT NOT NULL DEFAULT ''
+            )
+            """
+        )
+        os.chmod(self.path, 0o600)
+
+    def enqueue(
+        self,
+        kind: str,
+        page_id: str,
+        payload: Dict[str, Any],
+        notion_version: str,
+        idempotency_key: str,
+        pending_only: bool = False,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Insert a write unless its key is already queued.
+
+        With `pending_only`, a settled (delivered/failed) row with the same key
+        is renamed out of the way so a deliberate repeat is queued again.
+        """
+        now = to_iso_z(utc_now())
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if pending_only:
+                self.conn.execute(
+                    "UPDATE outbox SET idempotency_key = idempotency_key || '#' || id "
+                    "WHERE idempotency_key = ? AND state != 'pending'",
+                    (idempotency_key,),
+                )
+            cursor = self.conn.execute(
+                """
+                INSERT OR IGNORE INTO outbox
+                    (idempotency_key, kind, page_id, payload, notion_version, enqueued_at, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (idempotency_key, kind, page_id, json.dumps(payload, ensure_ascii=False), notion_version, now, now),
+            )
+            row = self.conn.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return dict(row), cursor.rowcount == 1
+
+    def pending(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("SELECT * FROM outbox WHERE state = 'pending' ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_delivered(self, item_id: int, result_id: str) -> None:
+        self.conn.execute(
+            "UPDATE outbox SET state = 'delivered', delivered_at = ?, result_id = ?, attempts = attempts + 1 "
+            "WHERE id = ?",
+            (to_iso_z(utc_now()), result_id, item_id),
+        )
+
+    def mark_attempt_failed(self, item_id: int, error: str, retry_at: Optional[dt.datetime]) -> None:
+        if retry_at is None:
+            self.conn.execute(
+                "UPDATE outbox SET state = 'failed', last_error = ?, attempts = attempts + 1 WHERE id = ?",
+                (error, item_id),
+            )
+            return
+        self.conn.execute(
+            "UPDATE outbox SET last_error = ?, attempts = attempts + 1, next_attempt_at = ? WHERE id = ?",
+            (error, to_iso_z(retry_at), item_id),
+        )
+
+    def failed(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("SELECT * FROM outbox WHERE state = 'failed' ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def acknowledge(self, item_ids: List[int]) -> int:
+        total = 0
+        for item_id in item_ids:
+            cursor = self.conn.execute(
+                "UPDATE outbox SET state = 'acknowledged' WHERE id = ? AND state = 'failed'",
+                (item_id,),
+            )
+            total += cursor.rowcount
+        return total
+
+    def counts(self) -> Dict[str, int]:
+        out = {"pending": 0, "delivered": 0, "failed": 0, "acknowledged": 0}
+        for row in self.conn.execute("SELECT state, COUNT(*) AS total FROM outbox GROUP BY state"):
+            out[str(row["state"])] = int(row["total"])
+        return out
+
+
+def outbox_idempotency_key(kind: str, page_id: str, payload: Dict[str, Any], explicit: Optional[str]) -> str:
+    if explicit:
+        return explicit
+    if kind == "comment":
+        # Content-addressed: re-enqueueing a comment that is still queued is a no-op.
+        digest = hashlib.sha256(
+            json.dumps([kind, page_id, payload], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return f"{kind}:{digest[:32]}"
+    return f"{kind}:{uuid.uuid4().hex}"
+
+
+def deliver_outbox_item(access_token: str, item: Dict[str, Any]) -> Tuple[str, bool]:
+    payload = json.loads(item["payload"])
+    notion_version = item["notion_version"]
+    if item["kind"] == "comment":
+        if int(item["attempts"]) > 0:
+            # An earlier attempt may have landed before the connection dropped.
+            enqueued_at = parse_iso(item["enqueued_at"])
+            not_before = enqueued_at - dt.timedelta(minutes=1) if enqueued_at else None
+            try:
+                existing = find_delivered_comment(
+                    access_token, notion_version, item["page_id"], payload["text"], not_before
+                )
+            except HttpError as exc:
+                # Reading comments is a separate capability from inserting them; without
+                # it the earlier attempt's outcome is unknown, so post rather than fail.
+                if exc.status not in {403, 404}:
+                    raise
+                existing = None
+            if existing:
+                return str(existing.get("id", "")), True
+        response = create_page_comment(access_token, notion_version, item["page_id"], payload["text"])
+        return str(response.get("id", "")), False
+    response = update_page_status(
+        access_token,
+        notion_version,
+        item["page_id"],
+        payload["status_property"],
+        payload["status"],
+    )
+    return str(response.get("id", "")), False
+
+
+def is_transient_write_error(exc: Exception) -> bool:
+    if isinstance(exc, HttpError):
+        return exc.status in {409, 429} or exc.status >= 500
+    return isinstance(exc, NetworkError)
+
+
+def outbox_failure(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": item["id"],
+        "kind": item["kind"],
+        "page_id": item["page_id"],
+        "attempts": item["attempts"],
+        "error": item["last_error"],
+        "payload": json.loads(item["payload"]),
+    }
+
+
+def flush_outbox(
+    outbox: Outbox,
+    access_token: str,
+    max_items: int,
+    rate: float,
+    max_attempts: int,
+) -> Dict[str, Any]:
+    stats: Dict[str, int] = {"delivered": 0, "deduplicated": 0, "retried": 0, "failed": 0}
+    min_interval = 1.0 / rate if rate > 0 else 0.0
+    last_sent = 0.0
+    processed = 0
+    # Writes for one page are applied in enqueue order; a deferred item holds back later ones.
+    held_pages = set()
+    now = utc_now()
+    for item in outbox.pending():
+        if processed >= max_items:
+            break
+        if item["page_id"] in held_pages:
+            continue
+        retry_at = parse_iso(item["next_attempt_at"])
+        if retry_at is not None and retry_at > now:
+            held_pages.add(item["page_id"])
+            continue
+        wait = last_sent + min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        last_sent = time.monotonic()
+        processed += 1
+        try:
+            result_id, deduplicated = deliver_outbox_item(access_token, item)
+        except (HttpError, NptError) as exc:
+            attempts = int(item["attempts"]) + 1
+            if is_transient_write_error(exc) and attempts < max_attempts:
+                backoff = min(OUTBOX_MAX_BACKOFF_SECONDS, 2**attempts)
+                outbox.mark_attempt_failed(item["id"], str(exc), utc_now() + dt.timedelta(seconds=backoff))
+                held_pages.add(item["page_id"])
+                stats["retried"] += 1
+            else:
+                outbox.mark_attempt_failed(item["id"], str(exc), None)
+                stats["failed"] += 1
+            continue
+        outbox.mark_delivered(item["id"], result_id)
+        stats["deduplicated" if deduplicated else "delivered"] += 1
+    return stats
+
+
+def next_outbox_attempt(outbox: Outbox) -> Optional[dt.datetime]:
+    due = [parse_iso(item["next_attempt_at"]) for item in outbox.pending()]
+    known = [value for value in due if value is not None]
+    if len(known) != len(due):
+        return utc_now()
+    return min(known) if known else None
+
+
+def spawn_background_flush(outbox: Outbox, access_token: str) -> bool:
+    """Start a detached flusher unless one already holds the outbox lock.
+
+    A running flusher re-checks the queue after releasing the lock, so rows
+    queued while it ran are not stranded by skipping the spawn.
+    """
+    with file_lock(outbox.lock_path, blocking=False) as free:
+        if not free:
+            return False
+    env = dict(os.environ)
+    env["NOTION_API_KEY"] = access_token
+    command = [sys.executable, str(pathlib.Path(__file__).resolve())]
+    session = active_workspace()
+    if session is not None:
+        command.extend(["--workspace", session.name])
+    subprocess.Popen(
+        command + ["flush", "--until-empty", "--lock-wait", "0"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+        start_new_session=True,
+    )
+    return True
+
+
+def maybe_refresh_store_token(store: TokenStore, token_bundle: Dict[str, Any]) -> Dict[str, Any]:
+    if not token_expiring_soon(token_bundle):
+        return token_bundle
+    refresh = token_bundle.get("refresh_token")
+    if not refresh:
+        return token_bundle
+    client_id, client_secret, _ = get_oauth_credentials()
+    refreshed = refresh_token(client_id, client_secret, str(refresh))
+    if "refresh_token" not in refreshed:
+        refreshed["refresh_token"] = refresh
+    store.save_token(refreshed)
+    return refreshed
+
+
+def resolve_query_token(
+    store: TokenStore,
+    explicit_token: Optional[str],
+) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    if explicit_token:
+        return explicit_token, "explicit_token", None
+    session = active_workspace()
+    if session is not None:
+        return session.access_token, session.source, None
+    api_key = os.getenv("NOTION_API_KEY")
+    if api_key:
+        return api_key, "notion_api_key", None
+    raise NptError(
+        "No query token found. Set NOTION_API_KEY."
+    )
+
+
+def workspace_registry_path() -> pathlib.Path:
+    return npt_config_dir() / "workspaces.json"
+
+
+def load_workspace_registry() -> Dict[str, Dict[str, Any]]:
+    registry = read_json_file(workspace_registry_path()) or {}
+    workspaces = registry.get("workspaces", {})
+    return workspaces if isinstance(workspaces, dict) else {}
+
+
+def save_workspace_registry(workspaces: Dict[str, Dict[str, Any]]) -> None:
+    write_json_file(workspace_registry_path(), {"workspaces": workspaces}, secure=True)
+
+
+def register_workspace(name: str, **fields: Any) -> Dict[str, Any]:
+    with file_lock(workspace_registry_path().with_suffix(".lock")):
+        workspaces = load_workspace_registry()
+        entry = dict(workspaces.get(name, {}))
+        entry.update({key: value for key, value in fields.items() if value is not None})
+        entry.setdefault("created_at", to_iso_z(utc_now()))
+        workspaces[name] = entry
+        save_workspace_registry(workspaces)
+    return entry
+
+
+def open_workspace_session(name: str) -> WorkspaceSession:
+    entry = load_workspace_registry().get(name)
+    if entry is None:
+        raise NptError(f"Unknown workspace {name!r}. Register it with workspace-add or oauth-login --workspace.")
+    token_env = str(entry.get("token_env") or "")
+    access_token = os.getenv(token_env) if token_env else None
+    source = f"workspace:{name}:env"
+    if not access_token:
+        store = TokenStore(name)
+        bundle = store.load_token()
+        if bundle:
+            bundle = maybe_refresh_store_token(store, bundle)
+            access_token = bundle.get("access_token")
+            source = f"workspace:{name}:oauth"
+    if not access_token:
+        hint = f"set {token_env}" if token_env else f"run oauth-login --workspace {name}"
+        raise NptError(f"No token for workspace {name!r}; {hint}.")
+    rate, burst = rate_limit_settings(entry)
+    return WorkspaceSession(name, str(access_token), source, rate, burst)
+
+
+def parse_workspace_names(values: Optional[List[str]]) -> List[str]:
+    raw = values if values else [os.getenv("NPT_WORKSPACE") or ""]
+    names = [part for value in raw for part in value.split(",") if part.strip()]
+    return list(dict.fromkeys(validate_workspace_name(name) for name in names))
+
+
+class ThreadOutputRouter(io.TextIOBase):
+    """stdout proxy that captures writes from threads that registered a buffer."""
+
+    def __init__(self, target: Any):
+        self.target = target
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self.local, "buffer", None)
+        return (buffer or self.target).write(text)
+
+    def flush(self) -> None:
+        self.target.flush()
+
+
+class LockedLineWriter(io.TextIOBase):
+    """Forward complete lines to `target` under a shared lock so threads never interleave."""
+
+    def __init__(self, target: Any, lock: threading.Lock):
+        self.target = target
+        self.lock = lock
+        self.pending = ""
+
+    def write(self, text: str) -> int:
+        self.pending += text
+        if "\n" in self.pending:
+            complete, _, self.pending = self.pending.rpartition("\n")
+            with self.lock:
+                self.target.write(complete + "\n")
+                self.target.flush()
+        return len(text)
+
+    def getvalue(self) -> str:
+        return self.pending
+
+
+def workspace_output_path(value: str, workspace: str) -> str:
+    """Insert the workspace name before the file suffix(es): out.ndjson.gz -> out.<ws>.ndjson.gz."""
+    path = pathlib.Path(value).expanduser()
+    suffixes = path.suffixes[-2:] if path.suffix == ".gz" else path.suffixes[-1:]
+    suffix = "".join(suffixes)
+    stem = path.name[: len(path.name) - len(suffix)] if suffix else path.name
+    return str(path.with_name(f"{stem}.{workspace}{suffix}"))
+
+
+def workspace_args(args: argparse.Namespace, shared: bool) -> argparse.Namespace:
+    """Copy of `args` for the active workspace; file paths are made per-workspace when `shared`."""
+    session = active_workspace()
+    if not shared or session is None:
+        return args
+    scoped = argparse.Namespace(**vars(args))
+    for dest in getattr(args, "workspace_paths", ()):
+        value = getattr(args, dest, None)
+        if value:
+            setattr(scoped, dest, workspace_output_path(value, session.name))
+    return scoped
+
+
+def run_workspace_command(
+    name: str,
+    router: ThreadOutputRouter,
+    run: Callable[[], None],
+    stream_lock: Optional[threading.Lock] = None,
+) -> Dict[str, Any]:
+    """Run `run` inside one workspace, capturing its stdout (or streaming it line by line)."""
+    buffer: Any = LockedLineWriter(router.target, stream_lock) if stream_lock else io.StringIO()
+    router.local.buffer = buffer
+    error = ""
+    try:
+        with workspace_context(open_workspace_session(name)):
+            run()
+    except (HttpError, NptError) as exc:
+        error = str(exc)
+    except Exception as exc:  # noqa: BLE001 - one workspace must not take the others down
+        error = f"{type(exc).__name__}: {exc}"
+    finally:
+        text = buffer.getvalue().strip()
+        router.local.buffer = None
+    if stream_lock:
+        if text:
+            buffer.write("\n")
+        return {"ok": not error, "error": error, "result": None}
+    try:
+        result: Any = json.loads(text) if text else None
+    except json.JSONDecodeError:
+        result = text
+    return {"ok": not error, "error": error, "result": result}
+
+
+def run_in_workspaces(names: List[str], run: Callable[[], None], stream: bool = False) -> None:
+    """Run one command across workspaces.
+
+    Buffered commands are merged into one JSON document keyed by workspace;
+    `stream` commands (NDJSON emitters) write their lines straight through.
+    """
+    if len(names) == 1:
+        with workspace_context(open_workspace_session(names[0])):
+            run()
+        return
+    router = ThreadOutputRouter(sys.stdout)
+    stream_lock = threading.Lock() if stream else None
+    original_stdout = sys.stdout
+    sys.stdout = router
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as executor:
+            futures = {name: executor.submit(run_workspace_command, name, router, run, stream_lock) for name in names}
+            results = {name: future.result() for name, future in futures.items()}
+    finally:
+        sys.stdout = original_stdout
+    failed = [name for name, result in results.items() if not result["ok"]]
+    if stream:
+        for name in failed:
+            print(json.dumps({"event": "error", "workspace": name, "error": results[name]["error"]}, ensure_ascii=False))
+    else:
+        print(dump_json({"ok": not failed, "workspaces": results}))
+    if failed:
+        raise NptError(f"Command failed for workspace(s): {', '.join(failed)}")
+
+
+def retrieve_data_source(access_token: str, notion_version: str, data_source_id: str) -> Dict[str, Any]:
+    endpoint = f"https://api.notion.com/v1/data_sources/{data_source_id}"
+    return request_json("GET", endpoint, headers=notion_headers(access_token, notion_version))
+
+
+def tag_index_path(data_source_id: str) -> pathlib.Path:
+    return workspace_data_dir() / "tag-index" / f"{data_source_id}.json"
+
+
+def cached_max_tags() -> int:
+    """max_tags from the resolve-workspace cache, without touching the network."""
+    try:
+        cached = read_json_file(workspace_cache_path()) or {}
+    except NptError:
+        cached = {}
+    value = cached.get("global_config", {}).get("max_tags", MAX_TAG_TYPES)
+    return value if isinstance(value, int) else MAX_TAG_TYPES
+
+
+def sync_tag_index(
+    access_token: str,
+    notion_version: str,
+    data_source_id: str,
+    tags_property: str,
+    rebuild: bool,
+    reconcile_after_seconds: int = DEFAULT_TAG_INDEX_RECONCILE_SECONDS,
+) -> Tuple[Dict[str, Any], str, int]:
+    """Bring the local tag index up to date.
+
+    Normally only pages edited since the last sync are read. The delta query
+    cannot see trashed or deleted pages, so every `reconcile_after_seconds`
+    the whole data source is rescanned (and the cached schema refreshed).
+    """
+    path = tag_index_path(data_source_id)
+    # Several agents share one index; serialize read-modify-write.
+    with file_lock(path.with_name(path.name + ".lock")):
+        index = None if rebuild else read_json_file(path)
+        if not index or index.get("tags_property") != tags_property:
+            index = {"tags_property": tags_property, "synced_at": "", "reconciled_at": "", "usage": {}, "pages": {}}
+        synced_at = parse_iso(index["synced_at"])
+        reconciled_at = parse_iso(index.get("reconciled_at", ""))
+        if synced_at is None:
+            mode = "full"
+        elif reconciled_at is None or utc_now() - reconciled_at >= dt.timedelta(seconds=reconcile_after_seconds):
+            mode = "reconcile"
+        else:
+            mode = "delta"
+
+        if mode != "delta" or "options" not in index:
+            schema = retrieve_data_source(access_token, notion_version, data_source_id)
+            node = schema.get("properties", {}).get(tags_property)
+            if not isinstance(node, dict) or node.get("type") != "multi_select":
+                raise NptError(f"Property {tags_property!r} is not a multi_select on data source {data_source_id}")
+            options = node.get("multi_select", {}).get("options", [])
+            index["options"] = [str(item["name"]) for item in options if isinstance(item, dict) and item.get("name")]
+
+        query_filter = None
+        if mode == "delta" and synced_at is not None:
+            since = synced_at - dt.timedelta(seconds=TAG_INDEX_SKEW_SECONDS)
+            query_filter = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": to_iso_z(since)}}
+        started = utc_now()
+        usage: Dict[str, int] = index["usage"]
+        page_tags: Dict[str, List[str]] = index["pages"]
+        unseen = set(page_tags) if mode != "delta" else set()
+        changed = 0
+        for page in iter_data_source_pages(
+            access_token=access_token,
+            notion_version=notion_version,
+            data_source_id=data_source_id,
+            page_size=100,
+            query_filter=query_filter,
+            stream=True,
+        ):
+            page_id = str(page.get("id", ""))
+            unseen.discard(page_id)
+            tags = extract_multi_select(page, tags_property)
+            previous = page_tags.get(page_id, [])
+            if tags == previous:
+                continue
+            changed += 1
+            update_tag_usage(usage, previous, tags)
+            if tags:
+                page_tags[page_id] = tags
+            else:
+                page_tags.pop(page_id, None)
+        # A full scan that no longer returns a page means it was trashed or deleted.
+        for page_id in unseen:
+            changed += 1
+            update_tag_usage(usage, page_tags.pop(page_id), [])
+        # Tags first seen on pages exist as options even before the next schema refresh.
+        index["options"].extend(tag for tag in usage if tag not in index["options"])
+        index["synced_at"] = to_iso_z(started)
+        if mode != "delta":
+            index["reconciled_at"] = index["synced_at"]
+        write_json_atomic(path, index)
+    return index, mode, changed
+
+
+def update_tag_usage(usage: Dict[str, int], previous: List[str], tags: List[str]) -> None:
+    for tag in previous:
+        usage[tag] = usage.get(tag, 0) - 1
+        if usage[tag] <= 0:
+            del usage[tag]
+    for tag in tags:
+        usage[tag] = usage.get(tag, 0) + 1
+
+
+def tag_matches_text(tag: str, text: str) -> Tuple[bool, bool]:
+    """Return (full, partial) match of a tag against lowercased task text."""
+    name = tag.lower().strip()
+    if not name:
+        return False, False
+    if not name.isascii():
+        # CJK tags have no word boundaries; substring match is the useful signal.
+        return name in text, False
+    if re.search(r"(?<![a-z0-9])" + re.escape(name) + r"(?![a-z0-9])", text):
+        return True, False
+    words = set(re.findall(r"[a-z0-9]+", text))
+    return False, any(part in words for part in re.findall(r"[a-z0-9]+", name))
+
+
+def rank_tags(vocabulary: List[Dict[str, Any]], text: str, limit: int) -> List[Dict[str, Any]]:
+    lowered = text.lower()
+    ranked = []
+    for entry in vocabulary:
+        full, partial = tag_matches_text(str(entry["name"]), lowered)
+        ranked.append(((not full, not partial, -entry["count"], entry["name"]), full or partial, entry))
+    ranked.sort(key=lambda item: item[0])
+    return [
+        {"name": entry["name"], "count": entry["count"], "matched": matched}
+        for _, matched, entry in ranked[:limit]
+    ]
+
+
+def list_project_data_sources(access_token: str, notion_version: str) -> List[str]:
+    resolved = resolve_workspace(access_token, notion_version)
+    projects_page_id = resolved.get("workspace", {}).get("projects_page_id", "")
+    if not projects_page_id:
+        raise NptError(f"{PROJECTS_PAGE_TITLE} page is not resolved; run resolve-workspace --refresh")
+    data_source_ids: List[str] = []
+    for block in list_block_children(access_token, notion_version, projects_page_id):
+        if block.get("type") != "child_database":
+            continue
+        database = retrieve_database(access_token, notion_version, str(block.get("id", "")))
+        for source in database.get("data_sources", []) or []:
+            if isinstance(source, dict) and source.get("id"):
+                data_source_ids.append(str(source["id"]))
+    return data_source_ids
+
+
+def write_json_atomic(path: pathlib.Path, data: Dict[str, Any]) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    write_json_file(tmp_path, data, secure=True)
+    os.replace(tmp_path, path)
+
+
+class ExportWriter:
+    """Append-only gzip writer committed in independent gzip members.
+
+    Each commit closes the current member and fsyncs, so the file can be
+    truncated back to any committed offset and appended to on resume.
+    """
+
+    def __init__(self, path: pathlib.Path, fmt: str, offset: Optional[int]):
+        ensure_parent(path)
+        if offset is None:
+            self._raw = open(path, "wb")
+        else:
+            self._raw = open(path, "r+b")
+            self._raw.truncate(offset)
+            self._raw.seek(offset)
+        self._fmt = fmt
+        self._member: Optional[gzip.GzipFile] = None
+        self._line = io.StringIO()
+        self._csv = csv.writer(self._line, lineterminator="\n")
+        if offset is None and fmt == "csv":
+            self._write_line(EXPORT_COLUMNS)
+
+    def _write_line(self, values: List[Any]) -> None:
+        self._line.seek(0)
+        self._line.truncate()
+        self._csv.writerow(values)
+        self._write(self._line.getvalue())
+
+    def _write(self, text: str) -> None:
+        if self._member is None:
+            self._member = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._member.write(text.encode("utf-8"))
+
+    def write_row(self, row: Dict[str, Any]) -> None:
+        if self._fmt == "ndjson":
+            self._write(json.dumps(row, ensure_ascii=False) + "\n")
+            return
+        values = [row.get(column, "") for column in EXPORT_COLUMNS]
+        values[EXPORT_COLUMNS.index("tags")] = ",".join(row.get("tags", []))
+        self._write_line(values)
+
+    def commit(self) -> int:
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        return self._raw.tell()
+
+    def close(self) -> None:
+        self.commit()
+        self._raw.close()
+
+
+def module_function_spans() -> List[Tuple[int, int, str]]:
+    spans: List[Tuple[int, int, str]] = []
+    candidates: List[Any] = list(globals().values())
+    for value in list(candidates):
+        if isinstance(value, type) and value.__module__ == __name__:
+            candidates.extend(vars(value).values())
+    for value in candidates:
+        code = getattr(value, "__code__", None)
+        if code is None or code.co_filename != __file__:
+            continue
+        lines = [line for _, line in dis.findlinestarts(code) if line is not None]
+        spans.append((code.co_firstlineno, max(lines, default=code.co_firstlineno), value.__qualname__))
+    return spans
+
+
+def describe_allocation_site(filename: str, lineno: int, spans: List[Tuple[int, int, str]]) -> str:
+    location = f"{pathlib.Path(filename).name}:{lineno}"
+    if filename != __file__:
+        return location
+    enclosing = [span for span in spans if span[0] <= lineno <= span[1]]
+    if not enclosing:
+        return location
+    # Innermost function wins for nested definitions.
+    name = max(enclosing, key=lambda span: span[0])[2]
+    return f"{name} ({location})"
+
+
+def cpu_profile_report(profiler: cProfile.Profile) -> str:
+    buf = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buf)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+    buf.write("\n")
+    stats.sort_stats("tottime").print_stats(PROFILE_TOP_N)
+    return buf.getvalue()
+
+
+class PeakSnapshotSampler(threading.Thread):
+    """Keep the tracemalloc snapshot taken closest to the traced-memory peak."""
+
+    def __init__(self, interval: float = 0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self.snapshot_size = 0
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self.snapshot_size * 1.1:
+                self.snapshot = tracemalloc.take_snapshot()
+                # Size what the snapshot holds, not the counter read before it was taken.
+                self.snapshot_size = snapshot_total(self.snapshot)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+def snapshot_total(snapshot: tracemalloc.Snapshot) -> int:
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+def memory_profile_report(snapshot: tracemalloc.Snapshot, label: str, current: int, peak: int) -> str:
+    spans = module_function_spans()
+    lines = [f"tracemalloc: current={current} bytes peak={peak} bytes", "", f"Top allocation sites ({label}):"]
+    for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+        frame = stat.traceback[0]
+        site = describe_allocation_site(frame.filename, frame.lineno, spans)
+        lines.append(f"  {stat.size:>12} B  {stat.count:>8} blocks  {site}")
+    by_function: Dict[str, int] = {}
+    for stat in snapshot.statistics("traceback"):
+        for frame in reversed(stat.traceback):
+            if frame.filename == __file__:
+                site = describe_allocation_site(frame.filename, frame.lineno, spans).split(" (")[0]
+                by_function[site] = by_function.get(site, 0) + stat.size
+                break
+    lines.extend(["", "Live bytes by innermost helper function:"])
+    for name, size in sorted(by_function.items(), key=lambda item: item[1], reverse=True)[:PROFILE_TOP_N]:
+        lines.append(f"  {size:>12} B  {name}")
+    return "\n".join(lines) + "\n"
+
+
+def run_with_profile(mode: str, output: Optional[str], func: Callable[[], None]) -> None:
+    report = ""
+    if mode == "cpu":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            func()
+        finally:
+            profiler.disable()
+            report = cpu_profile_report(profiler)
+    else:
+        tracemalloc.start(25)
+        sampler = PeakSnapshotSampler()
+        sampler.start()
+        try:
+            func()
+        finally:
+            sampler.stop()
+            current, peak = tracemalloc.get_traced_memory()
+            # bench resets the tracemalloc peak between phases; a sampled snapshot bounds it from below.
+            peak = max(peak, sampler.snapshot_size)
+            if sampler.snapshot is not None and sampler.snapshot_size > current:
+                snapshot, label = sampler.snapshot, f"near peak, {sampler.snapshot_size} bytes live"
+            else:
+                snapshot, label = tracemalloc.take_snapshot(), "live at exit"
+            tracemalloc.stop()
+            report = memory_profile_report(snapshot, label, current, peak)
+    if output:
+        path = pathlib.Path(output).expanduser()
+        ensure_parent(path)
+        path.write_text(report, encoding="utf-8")
+    else:
+        sys.stderr.write(report)
+
+
+def cmd_oauth_start(args: argparse.Namespace, store: TokenStore) -> None:
+    owner = args.owner or "user"
+    if owner not in {"user", "workspace"}:
+        raise NptError("--owner must be user or workspace")
+    client_id, _, redirect_uri = get_oauth_credentials(args.redirect_uri)
+    state = args.state or uuid.uuid4().hex
+    auth_url = build_auth_url(client_id, redirect_uri, state, owner)
     if not args.no_store_state:
         store.save_state(state, redirect_uri)
     output = {
@@ -632,6 +2364,8 @@ def cmd_oauth_login(args: argparse.Namespace, store: TokenStore) -> None:
     callback = wait_for_callback(redirect_uri=redirect_uri, expected_state=state, timeout_seconds=args.timeout)
     token_bundle = exchange_code(client_id, client_secret, callback["code"], redirect_uri)
     store.save_token(token_bundle)
+    if store.workspace:
+        register_workspace(store.workspace, oauth=True, workspace_id=token_bundle.get("workspace_id"))
 
     output = {
         "ok": True,
@@ -669,6 +2403,8 @@ def cmd_oauth_exchange(args: argparse.Namespace, store: TokenStore) -> None:
     client_id, client_secret, redirect_uri = get_oauth_credentials(args.redirect_uri)
     token_bundle = exchange_code(client_id, client_secret, code, redirect_uri)
     store.save_token(token_bundle)
+    if store.workspace:
+        register_workspace(store.workspace, oauth=True, workspace_id=token_bundle.get("workspace_id"))
     print(
         dump_json(
             {
@@ -721,37 +2457,82 @@ def cmd_oauth_token(_: argparse.Namespace, store: TokenStore) -> None:
     print(access_token)
 
 
+def cmd_resolve_workspace(args: argparse.Namespace, store: TokenStore) -> None:
+    if args.max_age < 0:
+        raise NptError("--max-age must be >= 0")
+    notion_version = args.notion_version or os.getenv("NOTION_VERSION") or DEFAULT_NOTION_VERSION
+    access_token, source, _ = resolve_query_token(store, args.access_token)
+    resolved = resolve_workspace(
+        access_token=access_token,
+        notion_version=notion_version,
+        max_age_seconds=args.max_age,
+        force_refresh=args.refresh,
+    )
+    output = {
+        "ok": True,
+        "source": source,
+        "cache": resolved["cache"],
+        "resolved_at": resolved.get("resolved_at", ""),
+        "workspace": resolved.get("workspace", {}),
+        "global_config": resolved.get("global_config", {}),
+        "raw_config": resolved.get("raw_config", {}),
+        "warnings": resolved.get("warnings", []),
+    }
+    print(dump_json(output))
+
+
 def cmd_query_active(args: argparse.Namespace, store: TokenStore) -> None:
     include_statuses = args.include_statuses or DEFAULT_INCLUDE_STATUSES
     active_statuses = args.active_statuses or DEFAULT_ACTIVE_STATUSES
     blocked_status = args.blocked_status or DEFAULT_BLOCKED_STATUS
     notion_version = args.notion_version or os.getenv("NOTION_VERSION") or DEFAULT_NOTION_VERSION
 
+    if args.limit is not None and args.limit < 1:
+        raise NptError("--limit must be >= 1")
+    sorts = [parse_sort_spec(spec) for spec in args.sort or []]
+
     access_token, source, _ = resolve_query_token(store, args.access_token)
-    while True:
-        try:
-            pages = query_data_source(
-                access_token=access_token,
-                notion_version=notion_version,
-                data_source_id=args.data_source_id,
-                status_property=args.status_property,
-                include_statuses=include_statuses,
-                page_size=args.page_size,
-            )
-            break
-        except HttpError as exc:
-            raise
+    active_set = set(active_statuses)
+    active_seen = 0
 
-    simplified = [simplify_page(page, args.status_property, args.title_property) for page in pages]
-    active = [item for item in simplified if item.get("status") in set(active_statuses)]
-    blocked = [item for item in simplified if item.get("status") == blocked_status]
-    skipped = len(simplified) - len(active) - len(blocked)
+    def limit_reached() -> bool:
+        return args.limit is not None and active_seen >= args.limit
+
+    state: Dict[str, Any] = {"truncated": False}
+    pages = iter_data_source_pages(
+        access_token=access_token,
+        notion_version=notion_version,
+        data_source_id=args.data_source_id,
+        page_size=args.page_size,
+        query_filter=status_filter(args.status_property, include_statuses),
+        sorts=sorts,
+        stream=not args.buffered,
+        stop_when=limit_reached,
+        state=state,
+    )
+    # Simplify while iterating so raw page objects are released one at a time.
+    simplified: List[Dict[str, Any]] = []
+    truncated = False
+    for page in pages:
+        if limit_reached():
+            # Drain the response already in flight; no further request is issued.
+            truncated = True
+            continue
+        item = simplify_page(page, args.status_property, args.title_property)
+        simplified.append(item)
+        if item.get("status") in active_set:
+            active_seen += 1
+    truncated = truncated or bool(state["truncated"])
+    active, blocked, skipped = group_pages(simplified, active_statuses, blocked_status)
 
     output = {
         "query_confidence": "high",
         "source": source,
         "data_source_id": args.data_source_id,
         "status_property": args.status_property,
+        "sorts": sorts,
+        "limit": args.limit,
+        "truncated": truncated,
         "counts": {
             "total": len(simplified),
             "active": len(active),
@@ -765,10 +2546,493 @@ def cmd_query_active(args: argparse.Namespace, store: TokenStore) -> None:
     print(dump_json(output))
 
 
-def cmd_create_comment(args: argparse.Namespace, store: TokenStore) -> None:
+def discovery_state_path(data_source_id: str, explicit: Optional[str]) -> pathlib.Path:
+    if explicit:
+        return pathlib.Path(explicit).expanduser()
+    return workspace_data_dir() / "discovery" / f"{data_source_id}.json"
+
+
+def text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def diff_page(
+    item: Dict[str, Any],
+    previous: Optional[Dict[str, str]],
+    active_set: set,
+) -> List[Dict[str, Any]]:
+    """Change events for one simplified page against its stored key."""
+    base = {"id": item["id"], "title": item["title"], "url": item.get("url", "")}
+    status = item["status"]
+    if previous is None:
+        return [dict(base, event="added", status=status, created_time=item.get("created_time", ""))]
+    events: List[Dict[str, Any]] = []
+    if previous.get("s") != status:
+        events.append(
+            dict(
+                base,
+                event="status_changed",
+                **{"from": previous.get("s", ""), "to": status},
+                was_active=previous.get("s") in active_set,
+                is_active=status in active_set,
+            )
+        )
+    if previous.get("t") != text_digest(item["title"]):
+        events.append(dict(base, event="title_changed", status=status))
+    return events
+
+
+def cmd_diff(args: argparse.Namespace, store: TokenStore) -> None:
+    include_statuses = args.include_statuses or DEFAULT_INCLUDE_STATUSES
+    active_set = set(args.active_statuses or DEFAULT_ACTIVE_STATUSES)
+    notion_version = args.notion_version or os.getenv("NOTION_VERSION") or DEFAULT_NOTION_VERSION
+    access_token, _, _ = resolve_query_token(store, args.access_token)
+    state_path = discovery_state_path(args.data_source_id, args.state_path)
+    try:
+        state = read_json_file(state_path) or {}
+    except NptError:
+        state = {}
+    previous: Dict[str, Dict[str, str]] = state.get("pages", {}) if isinstance(state.get("pages"), dict) else {}
+    discovered_at = to_iso_z(utc_now())
+
+    session = active_workspace()
+
+    def emit(event: Dict[str, Any]) -> None:
+        event["at"] = discovered_at
+        if session is not None:
+            event["workspace"] = session.name
+        print(json.dumps(event, ensure_ascii=False))
+
+    current: Dict[str, Dict[str, str]] = {}
+    pages = iter_data_source_pages(
+        access_token=access_token,
+        notion_version=notion_version,
+        data_source_id=args.data_source_id,
+        page_size=args.page_size,
+        query_filter=status_filter(args.status_property, include_statuses),
+        stream=not args.buffered,
+    )
+    # Events are written as pages arrive; only compact per-page keys are retained.
+    for page in pages:
+        item = simplify_page(page, args.status_property, args.title_property)
+        for event in diff_page(item, previous.get(item["id"]), active_set):
+            emit(event)
+        current[item["id"]] = {"s": item["status"], "t": text_digest(item["title"])}
+    for page_id, key in previous.items():
+        if page_id in current:
+            continue
+        status = key.get("s", "")
+        emit({"event": "left_active" if status in active_set else "removed", "id": page_id, "from": status})
+
+    if not args.no_save:
+        ensure_parent(state_path)
+        write_json_atomic(
+            state_path,
+            {
+                "data_source_id": args.data_source_id,
+                "status_property": args.status_property,
+                "discovered_at": discovered_at,
+                "pages": current,
+            },
+        )
+
+
+def cmd_export(args: argparse.Namespace, store: TokenStore) -> None:
+    if args.checkpoint_every < 1:
+        raise NptError("--checkpoint-every must be >= 1")
     notion_version = args.notion_version or os.getenv("NOTION_VERSION") or DEFAULT_NOTION_VERSION
     access_token, source, _ = resolve_query_token(store, args.access_token)
+    output_path = pathlib.Path(args.output).expanduser()
+    checkpoint_path = output_path.with_name(output_path.name + ".checkpoint.json")
+    fmt = args.format
+
+    offset: Optional[int] = None
+    if args.resume:
+        checkpoint = read_json_file(checkpoint_path)
+        if not checkpoint:
+            raise NptError(f"No export checkpoint found at {checkpoint_path}")
+        if checkpoint.get("format") != fmt:
+            raise NptError(f"Checkpoint was written as {checkpoint.get('format')}; rerun with --format to match")
+        if not output_path.exists():
+            raise NptError(f"Export file missing for checkpoint: {output_path}")
+        data_source_ids = [str(item) for item in checkpoint.get("data_source_ids", [])]
+        start_index = int(checkpoint.get("index", 0))
+        start_cursor = checkpoint.get("cursor") or None
+        offset = int(checkpoint.get("offset", 0))
+        rows = int(checkpoint.get("rows", 0))
+    else:
+        if checkpoint_path.exists():
+            raise NptError(f"Interrupted export checkpoint exists at {checkpoint_path}; pass --resume or delete it")
+        if args.all_projects:
+            data_source_ids = list_project_data_sources(access_token, notion_version)
+        else:
+            data_source_ids = list(dict.fromkeys(args.data_source_id))
+        start_index = 0
+        start_cursor = None
+        rows = 0
+
+    writer = ExportWriter(output_path, fmt, offset)
+    pages_since_checkpoint = 0
+
+    def save_checkpoint(index: int, cursor: Optional[str]) -> None:
+        nonlocal pages_since_checkpoint
+        pages_since_checkpoint = 0
+        write_json_atomic(
+            checkpoint_path,
+            {
+                "format": fmt,
+                "data_source_ids": data_source_ids,
+                "index": index,
+                "cursor": cursor or "",
+                "offset": writer.commit(),
+                "rows": rows,
+                "updated_at": to_iso_z(utc_now()),
+            },
+        )
+
+    try:
+        for index in range(start_index, len(data_source_ids)):
+            data_source_id = data_source_ids[index]
+
+            def on_page_end(next_cursor: Optional[str], index: int = index) -> None:
+                nonlocal pages_since_checkpoint
+                pages_since_checkpoint += 1
+                if next_cursor and pages_since_checkpoint >= args.checkpoint_every:
+                    save_checkpoint(index, next_cursor)
+
+            pages = iter_data_source_pages(
+                access_token=access_token,
+                notion_version=notion_version,
+                data_source_id=data_source_id,
+                page_size=args.page_size,
+                sorts=[{"timestamp": "created_time", "direction": "ascending"}],
+                stream=True,
+                start_cursor=start_cursor if index == start_index else None,
+                on_page_end=on_page_end,
+            )
+            for page in pages:
+                writer.write_row(
+                    export_row(page, data_source_id, args.status_property, args.title_property, args.tags_property)
+                )
+                rows += 1
+            save_checkpoint(index + 1, None)
+    finally:
+        writer.close()
+    checkpoint_path.unlink()
+
+    output = {
+        "ok": True,
+        "source": source,
+        "output": str(output_path),
+        "format": fmt,
+        "compression": "gzip",
+        "columns": EXPORT_COLUMNS,
+        "data_source_ids": data_source_ids,
+        "rows": rows,
+        "resumed": bool(args.resume),
+    }
+    print(dump_json(output))
+
+
+def cmd_workspace_add(args: argparse.Namespace, _: TokenStore) -> None:
+    name = validate_workspace_name(args.name)
+    if args.rate_limit is not None and args.rate_limit < 0:
+        raise NptError("--rate-limit must be >= 0")
+    entry = register_workspace(
+        name,
+        token_env=args.token_env,
+        rate_limit=args.rate_limit,
+        rate_burst=args.rate_burst,
+    )
+    print(dump_json({"ok": True, "name": name, "workspace": entry}))
+
+
+def cmd_workspace_list(_: argparse.Namespace, __: TokenStore) -> None:
+    rows = []
+    for name, entry in sorted(load_workspace_registry().items()):
+        token_env = str(entry.get("token_env") or "")
+        rate, burst = rate_limit_settings(entry)
+        rows.append(
+            {
+                "name": name,
+                "token_env": token_env,
+                "token_env_set": bool(token_env and os.getenv(token_env)),
+                "has_oauth_token": TokenStore(name).load_token() is not None,
+                "rate_limit": rate,
+                "rate_burst": burst,
+            }
+        )
+    print(dump_json({"ok": True, "workspaces": rows}))
 
+
+def cmd_workspace_remove(args: argparse.Namespace, _: TokenStore) -> None:
+    name = validate_workspace_name(args.name)
+    with file_lock(workspace_registry_path().with_suffix(".lock")):
+        workspaces = load_workspace_registry()
+        if name not in workspaces:
+            raise NptError(f"Unknown workspace {name!r}")
+        del workspaces[name]
+        save_workspace_registry(workspaces)
+    # Stored OAuth bundles and caches are left in place so the entry can be re-added.
+    print(dump_json({"ok": True, "removed": name}))
+
+
+def cmd_tags(args: argparse.Namespace, store: TokenStore) -> None:
+    if args.suggest < 0:
+        raise NptError("--suggest must be >= 0")
+    notion_version = args.notion_version or os.getenv("NOTION_VERSION") or DEFAULT_NOTION_VERSION
+    access_token, source, _ = resolve_query_token(store, args.access_token)
+    index, mode, changed = sync_tag_index(
+        access_token,
+        notion_version,
+        args.data_source_id,
+        args.tags_property,
+        args.rebuild,
+        args.reconcile_after,
+    )
+    max_tags = args.max_tags if args.max_tags is not None else cached_max_tags()
+    cap = max(1, min(MAX_TAG_TYPES, max_tags))
+    usage: Dict[str, int] = index["usage"]
+    names = list(dict.fromkeys(index["options"] + sorted(usage)))
+    vocabulary = sorted(
+        ({"name": name, "count": usage.get(name, 0)} for name in names),
+        key=lambda entry: (-entry["count"], entry["name"]),
+    )
+    remaining = max(0, cap - len(vocabulary))
+    suggestions = [
+        {"text": text, "tags": rank_tags(vocabulary, text, args.suggest)} for text in args.text or []
+    ]
+    output = {
+        "ok": True,
+        "source": source,
+        "data_source_id": args.data_source_id,
+        "tags_property": args.tags_property,
+        "sync": mode,
+        "changed_pages": changed,
+        "synced_at": index["synced_at"],
+        "max_tag_types": cap,
+        "vocabulary_size": len(vocabulary),
+        "remaining_capacity": remaining,
+        "can_create_new": remaining > 0,
+        "vocabulary": vocabulary,
+        "suggestions": suggestions,
+    }
+    print(dump_json(output))
+
+
+def synthetic_query_responses(total_pages: int, rich_text_nodes: int, page_size: int = 100) -> List[bytes]:
+    statuses = DEFAULT_INCLUDE_STATUSES + ["已完成"]
+    responses: List[bytes] = []
+    for start in range(0, total_pages, page_size):
+        results = []
+        for index in range(start, min(total_pages, start + page_size)):
+            title = [
+                {
+                    "type": "text",
+                    "text": {"content": f"任务 {index} 段落 {node} " + "x" * 40, "link": None},
+                    "annotations": {"bold": False, "italic": False, "code": False, "color": "default"},
+                    "plain_text": f"任务 {index} 段落 {node} " + "x" * 40,
+                    "href": None,
+                }
+                for node in range(rich_text_nodes)
+            ]
+            results.append(
+                {
+                    "object": "page",
+                    "id": str(uuid.UUID(int=index)),
+                    "url": f"https://www.notion.so/{index:032x}",
+                    "created_time": "2026-01-01T00:00:00.000Z",
+                    "last_edited_time": "2026-01-02T00:00:00.000Z",
+                    "properties": {
+                        "状态": {"id": "s", "type": "select", "select": {"name": statuses[index % len(statuses)]}},
+                        "任务": {"id": "title", "type": "title", "title": title},
+                        "标签": {"id": "t", "type": "multi_select", "multi_select": [{"name": "bench"}]},
+                    },
+                }
+            )
+        more = start + page_size < total_pages
+        envelope = {"object": "list", "results": results, "next_cursor": str(start) if more else None, "has_more": more}
+        responses.append(json.dumps(envelope, ensure_ascii=False).encode("utf-8"))
+    return responses
+
+
+def load_recorded_responses(path: pathlib.Path) -> List[bytes]:
+    """Read recorded query responses: one JSON object, a JSON list, or NDJSON."""
+    if not path.exists():
+        raise NptError(f"Bench input not found: {path}")
+    raw = path.read_bytes()
+    try:
+        parsed = json.loads(raw)
+    except json.JSONDecodeError:
+        lines = [line for line in raw.splitlines() if line.strip()]
+        return lines
+    if isinstance(parsed, list):
+        return [json.dumps(item, ensure_ascii=False).encode("utf-8") for item in parsed]
+    return [raw]
+
+
+def bench_pipeline(responses: List[bytes], stream: bool) -> Tuple[int, int]:
+    simplified: List[Dict[str, Any]] = []
+    for raw in responses:
+        if stream:
+            pages: Iterator[Any] = iter_json_results(io.BytesIO(raw).read, {})
+        else:
+            pages = iter(json_loads(raw).get("results", []))
+        simplified.extend(simplify_page(page, "状态", "任务") for page in pages if isinstance(page, dict))
+    active, blocked, _ = group_pages(simplified, DEFAULT_ACTIVE_STATUSES, DEFAULT_BLOCKED_STATUS)
+    return len(simplified), len(active) + len(blocked)
+
+
+def best_of(repeat: int, func: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    # Reuse an active trace (e.g. under --profile mem) instead of stopping it.
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        return tracemalloc.get_traced_memory()[1] - start
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+
+
+STREAM_ROUNDTRIP_SAMPLE = {
+    "score": 0.125,
+    "total": 12,
+    "scale": -6.5e+21,
+    "object": "list",
+    "results": [
+        {"id": "a", "n": [0, -1, 0.5, 1.25e-3, 6e2, -2.5e-10, 12345678901234567890]},
+        {"id": "b", "t": ["", "\\\"}]{[", "中文", "\u2028"], "x": None, "y": True, "z": {}},
+        [],
+    ],
+    "ratio": 1e-3,
+    "next_cursor": None,
+    "has_more": False,
+}
+STREAM_ROUNDTRIP_CHUNK_SIZES = (1, 2, 3, 7, 64)
+
+
+def verify_stream_decoding(responses: List[bytes]) -> None:
+    """Check the streaming reader against json_loads at tiny read sizes.
+
+    Small chunks cut numbers, strings and multi-byte characters at every
+    possible offset, which the default 64 KB reads almost never do.
+    """
+    samples = [json.dumps(STREAM_ROUNDTRIP_SAMPLE, ensure_ascii=False).encode("utf-8")] + responses[:1]
+    for raw in samples:
+        expected = json_loads(raw)
+        for chunk_size in STREAM_ROUNDTRIP_CHUNK_SIZES:
+            envelope: Dict[str, Any] = {}
+            try:
+                results = list(iter_json_results(io.BytesIO(raw).read, envelope, chunk_size=chunk_size))
+            except json.JSONDecodeError as exc:
+                raise NptError(f"Streaming decoder failed at chunk size {chunk_size}: {exc}") from exc
+            envelope["results"] = results
+            if envelope != expected:
+                raise NptError(f"Streaming decoder round-trip mismatch at chunk size {chunk_size}")
+
+
+def run_bench(responses: List[bytes], repeat: int) -> Dict[str, float]:
+    decoded = [json_loads(raw) for raw in responses]
+    pages = [page for response in decoded for page in response.get("results", []) if isinstance(page, dict)]
+    simplified = [simplify_page(page, "状态", "任务") for page in pages]
+    return {
+        "parse_buffered_seconds": best_of(repeat, lambda: [json_loads(raw) for raw in responses]),
+        "parse_stream_seconds": best_of(
+            repeat, lambda: [list(iter_json_results(io.BytesIO(raw).read, {})) for raw in responses]
+        ),
+        "simplify_seconds": best_of(repeat, lambda: [simplify_page(page, "状态", "任务") for page in pages]),
+        "group_seconds": best_of(
+            repeat, lambda: group_pages(simplified, DEFAULT_ACTIVE_STATUSES, DEFAULT_BLOCKED_STATUS)
+        ),
+        "pipeline_stream_seconds": best_of(repeat, lambda: bench_pipeline(responses, stream=True)),
+        "pipeline_buffered_seconds": best_of(repeat, lambda: bench_pipeline(responses, stream=False)),
+        "pipeline_stream_peak_bytes": float(peak_memory(lambda: bench_pipeline(responses, stream=True))),
+        "pipeline_buffered_peak_bytes": float(peak_memory(lambda: bench_pipeline(responses, stream=False))),
+    }
+
+
+def bench_baseline_path(explicit: Optional[str]) -> pathlib.Path:
+    if explicit:
+        return pathlib.Path(explicit).expanduser()
+    return npt_config_dir() / "bench-baseline.json"
+
+
+def cmd_bench(args: argparse.Namespace, _: TokenStore) -> None:
+    if args.repeat < 1:
+        raise NptError("--repeat must be >= 1")
+    if args.pages < 1 or args.rich_text_nodes < 1:
+        raise NptError("--pages and --rich-text-nodes must be >= 1")
+    if args.input:
+        input_path = pathlib.Path(args.input).expanduser()
+        responses = load_recorded_responses(input_path)
+        workload = f"recorded:{hashlib.sha256(b''.join(responses)).hexdigest()[:16]}"
+    else:
+        responses = synthetic_query_responses(args.pages, args.rich_text_nodes)
+        workload = f"synthetic:pages={args.pages}:rich_text_nodes={args.rich_text_nodes}"
+    verify_stream_decoding(responses)
+    metrics = run_bench(responses, args.repeat)
+    json_backend = choose_json_backend()
+    python_version = ".".join(str(part) for part in sys.version_info[:2])
+    # Timings are only comparable on the same JSON backend and interpreter.
+    baseline_key = f"{workload}|json={json_backend}|python={python_version}"
+
+    baseline_path = bench_baseline_path(args.baseline)
+    baselines = read_json_file(baseline_path) or {}
+    baseline = baselines.get(baseline_key)
+    comparisons: Dict[str, Any] = {}
+    regressions: List[str] = []
+    if isinstance(baseline, dict):
+        for name, value in metrics.items():
+            previous = baseline.get("metrics", {}).get(name)
+            if not previous:
+                continue
+            ratio = value / float(previous)
+            comparisons[name] = {"baseline": previous, "current": value, "ratio": round(ratio, 3)}
+            if ratio > 1 + args.tolerance:
+                regressions.append(name)
+    if args.save_baseline:
+        baselines[baseline_key] = {
+            "saved_at": to_iso_z(utc_now()),
+            "json_backend": json_backend,
+            "python": sys.version.split()[0],
+            "metrics": metrics,
+        }
+        write_json_file(baseline_path, baselines, secure=False)
+
+    output = {
+        "ok": not regressions,
+        "workload": workload,
+        "baseline_key": baseline_key,
+        "responses": len(responses),
+        "json_backend": json_backend,
+        "repeat": args.repeat,
+        "metrics": metrics,
+        "baseline_path": str(baseline_path),
+        "baseline_found": isinstance(baseline, dict),
+        "baseline_saved": bool(args.save_baseline),
+        "tolerance": args.tolerance,
+        "comparisons": comparisons,
+        "regressions": regressions,
+    }
+    print(dump_json(output))
+    if regressions and not args.save_baseline:
+        raise NptError(f"Benchmark regression beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+
+
+def read_comment_text(args: argparse.Namespace) -> str:
     text = ""
     if args.text is not None:
         text = args.text
@@ -782,6 +3046,48 @@ def cmd_create_comment(args: argparse.Namespace, store: TokenStore) -> None:
 
     if not text.strip():
         raise NptError("Comment text is empty. Provide --text, --text-file, or --stdin.")
+    return text
+
+
+def enqueue_write(
+    args: argparse.Namespace,
+    access_token: str,
+    source: str,
+    kind: str,
+    payload: Dict[str, Any],
+    notion_version: str,
+) -> None:
+    outbox = Outbox()
+    key = outbox_idempotency_key(kind, args.page_id, payload, args.idempotency_key)
+    item, created = outbox.enqueue(
+        kind, args.page_id, payload, notion_version, key, pending_only=not args.idempotency_key
+    )
+    spawned = spawn_background_flush(outbox, access_token) if args.spawn_flush else False
+    output = {
+        "ok": True,
+        "queued": True,
+        "source": source,
+        "kind": kind,
+        "page_id": args.page_id,
+        "outbox_id": item["id"],
+        "idempotency_key": key,
+        "duplicate": not created,
+        "state": item["state"],
+        "flush_spawned": spawned,
+    }
+    print(dump_json(output))
+
+
+def cmd_create_comment(args: argparse.Namespace, store: TokenStore) -> None:
+    if args.spawn_flush and not args.queue:
+        raise NptError("--spawn-flush requires --queue")
+    notion_version = args.notion_version or os.getenv("NOTION_VERSION") or DEFAULT_NOTION_VERSION
+    access_token, source, _ = resolve_query_token(store, args.access_token)
+    text = read_comment_text(args)
+    if args.queue:
+        build_comment_rich_text(text)
+        enqueue_write(args, access_token, source, "comment", {"text": text}, notion_version)
+        return
 
     response = create_page_comment(
         access_token=access_token,
@@ -799,8 +3105,117 @@ def cmd_create_comment(args: argparse.Namespace, store: TokenStore) -> None:
     print(dump_json(output))
 
 
+def cmd_update_status(args: argparse.Namespace, store: TokenStore) -> None:
+    if args.spawn_flush and not args.queue:
+        raise NptError("--spawn-flush requires --queue")
+    notion_version = args.notion_version or os.getenv("NOTION_VERSION") or DEFAULT_NOTION_VERSION
+    access_token, source, _ = resolve_query_token(store, args.access_token)
+    if not args.status.strip():
+        raise NptError("--status must not be empty")
+    if args.queue:
+        payload = {"status_property": args.status_property, "status": args.status}
+        enqueue_write(args, access_token, source, "status", payload, notion_version)
+        return
+    update_page_status(access_token, notion_version, args.page_id, args.status_property, args.status)
+    output = {
+        "ok": True,
+        "source": source,
+        "page_id": args.page_id,
+        "status_property": args.status_property,
+        "status": args.status,
+    }
+    print(dump_json(output))
+
+
+def cmd_flush(args: argparse.Namespace, store: TokenStore) -> None:
+    if args.max_items < 1:
+        raise NptError("--max-items must be >= 1")
+    if args.rate < 0:
+        raise NptError("--rate must be >= 0")
+    if args.max_attempts < 1:
+        raise NptError("--max-attempts must be >= 1")
+    access_token, source, _ = resolve_query_token(store, args.access_token)
+    outbox = Outbox()
+    acknowledged = outbox.acknowledge(args.ack or [])
+    totals: Dict[str, int] = {"delivered": 0, "deduplicated": 0, "retried": 0, "failed": 0}
+    deadline = time.monotonic() + args.timeout
+    if args.lock_wait is not None:
+        lock_wait = max(0.0, args.lock_wait)
+    else:
+        # --until-empty waits for a concurrent flusher so its caller sees the final queue state.
+        lock_wait = float(args.timeout) if args.until_empty else 0.0
+    flushed = False
+    while True:
+        drained = False
+        with file_lock(outbox.lock_path, blocking=lock_wait > 0, timeout=lock_wait) as acquired:
+            if acquired:
+                flushed = True
+                while True:
+                    stats = flush_outbox(outbox, access_token, args.max_items, args.rate, args.max_attempts)
+                    for key, value in stats.items():
+                        totals[key] += value
+                    if not args.until_empty:
+                        break
+                    next_attempt = next_outbox_attempt(outbox)
+                    if next_attempt is None:
+                        drained = True
+                        break
+                    wait = max(0.0, (next_attempt - utc_now()).total_seconds())
+                    if time.monotonic() + wait > deadline:
+                        break
+                    time.sleep(wait)
+        # Writers that found the lock held skipped spawning a flusher; pick up what they queued.
+        if not drained or next_outbox_attempt(outbox) is None:
+            break
+        lock_wait = 0.0
+    output = {
+        "ok": True,
+        "source": source,
+        "flushed": flushed,
+        "note": "" if flushed else "another flush is still running",
+        **totals,
+        "acknowledged": acknowledged,
+        # Every permanently rejected write stays listed until acknowledged with --ack.
+        "failures": [outbox_failure(item) for item in outbox.failed()],
+        "queue": outbox.counts(),
+    }
+    print(dump_json(output))
+
+
+def add_outbox_arguments(parser: argparse.ArgumentParser, default_key: str) -> None:
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="Enqueue in the local durable outbox instead of writing to Notion now",
+    )
+    parser.add_argument("--idempotency-key", help=f"Outbox dedupe key (default: {default_key})")
+    parser.add_argument(
+        "--spawn-flush",
+        action="store_true",
+        help="With --queue, start a detached `flush --until-empty` process unless one is already running",
+    )
+
+
+def add_status_query_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--data-source-id", required=True, help="Notion data source UUID")
+    parser.add_argument("--status-property", default="状态", help="Status property name")
+    parser.add_argument("--title-property", default="任务", help="Title property name")
+    parser.add_argument("--include-statuses", action="append", help="Status to include (repeatable)")
+    parser.add_argument("--active-statuses", action="append", help="Statuses treated as active")
+    parser.add_argument("--page-size", type=int, default=100, help="Query page size (1-100)")
+    parser.add_argument("--notion-version", help="Notion-Version header")
+    parser.add_argument("--access-token", help="Explicit bearer token")
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="NPT Notion OAuth and data source query helper")
+    parser.add_argument("--profile", choices=PROFILE_MODES, help="Profile the command with cProfile or tracemalloc")
+    parser.add_argument("--profile-output", help="Write the profile report to this file (default: stderr)")
+    parser.add_argument(
+        "--workspace",
+        action="append",
+        help="Registered workspace name (repeatable or comma-separated; default: $NPT_WORKSPACE)",
+    )
     sub = parser.add_subparsers(dest="command", required=True)
 
     p_login = sub.add_parser("oauth-login", help="Open browser and complete OAuth exchange automatically")
@@ -816,7 +3231,7 @@ def build_parser() -> argparse.ArgumentParser:
     p_login.add_argument("--no-open", action="store_true", help="Do not auto-open browser")
     p_login.add_argument("--no-store-state", action="store_true", help="Do not persist generated state")
     p_login.add_argument("--json", action="store_true", help="Output JSON only")
-    p_login.set_defaults(func=cmd_oauth_login)
+    p_login.set_defaults(workspace_scope="store", func=cmd_oauth_login)
 
     p_start = sub.add_parser("oauth-start", help="Generate OAuth authorization URL")
     p_start.add_argument("--owner", default="user", help="OAuth owner value: user or workspace")
@@ -824,7 +3239,7 @@ def build_parser() -> argparse.ArgumentParser:
     p_start.add_argument("--state", help="Explicit state value")
     p_start.add_argument("--no-store-state", action="store_true", help="Do not persist generated state")
     p_start.add_argument("--json", action="store_true", help="Output JSON only")
-    p_start.set_defaults(func=cmd_oauth_start)
+    p_start.set_defaults(workspace_scope="store", func=cmd_oauth_start)
 
     p_exchange = sub.add_parser("oauth-exchange", help="Exchange OAuth code for token bundle")
     p_exchange.add_argument("--code", help="Authorization code")
@@ -832,31 +3247,93 @@ def build_parser() -> argparse.ArgumentParser:
     p_exchange.add_argument("--state", help="Expected state override")
     p_exchange.add_argument("--redirect-uri", help="Override redirect URI")
     p_exchange.add_argument("--skip-state-check", action="store_true", help="Skip state validation")
-    p_exchange.set_defaults(func=cmd_oauth_exchange)
+    p_exchange.set_defaults(workspace_scope="store", func=cmd_oauth_exchange)
 
     p_refresh = sub.add_parser("oauth-refresh", help="Refresh stored OAuth token")
-    p_refresh.set_defaults(func=cmd_oauth_refresh)
+    p_refresh.set_defaults(workspace_scope="store", func=cmd_oauth_refresh)
 
     p_token = sub.add_parser("oauth-token", help="Print valid access token from store")
-    p_token.set_defaults(func=cmd_oauth_token)
+    p_token.set_defaults(workspace_scope="store", func=cmd_oauth_token)
+
+    p_workspace = sub.add_parser(
+        "resolve-workspace",
+        help="Resolve NPT workspace topology and GLOBAL_CONFIG (cached, revalidated on each run)",
+    )
+    p_workspace.add_argument(
+        "--max-age",
+        type=int,
+        default=DEFAULT_WORKSPACE_CACHE_MAX_AGE_SECONDS,
+        help="Force full re-resolution when the cache is older than this many seconds",
+    )
+    p_workspace.add_argument("--refresh", action="store_true", help="Ignore the cache and re-resolve")
+    p_workspace.add_argument("--notion-version", help="Notion-Version header")
+    p_workspace.add_argument("--access-token", help="Explicit bearer token")
+    p_workspace.set_defaults(func=cmd_resolve_workspace)
 
     p_query = sub.add_parser("query-active", help="Exact query for NPT statuses via data_sources/query")
-    p_query.add_argument("--data-source-id", required=True, help="Notion data source UUID")
-    p_query.add_argument("--status-property", default="状态", help="Status property name")
-    p_query.add_argument("--title-property", default="任务", help="Title property name")
-    p_query.add_argument("--include-statuses", action="append", help="Status to include (repeatable)")
-    p_query.add_argument("--active-statuses", action="append", help="Statuses treated as active")
+    add_status_query_arguments(p_query)
     p_query.add_argument("--blocked-status", default=DEFAULT_BLOCKED_STATUS, help="Blocked status label")
-    p_query.add_argument("--page-size", type=int, default=100, help="Query page size (1-100)")
-    p_query.add_argument("--notion-version", help="Notion-Version header")
-    p_query.add_argument("--access-token", help="Explicit bearer token")
     p_query.add_argument(
         "--include-all",
         action="store_true",
         help="Include complete simplified result list under `all`",
     )
+    p_query.add_argument(
+        "--sort",
+        action="append",
+        help="Server-side sort as <field>:asc|desc, e.g. created_time:desc (repeatable)",
+    )
+    p_query.add_argument(
+        "--limit",
+        type=int,
+        help="Stop paginating once this many active items are collected",
+    )
+    p_query.add_argument(
+        "--buffered",
+        action="store_true",
+        help="Decode each response page in one shot (orjson when installed) instead of streaming results",
+    )
     p_query.set_defaults(func=cmd_query_active)
 
+    p_diff = sub.add_parser("diff", help="Emit NDJSON change events since the previous discovery")
+    add_status_query_arguments(p_diff)
+    p_diff.add_argument(
+        "--state-path",
+        help="Previous discovery snapshot (default: NPT_CONFIG_DIR/discovery/<data-source-id>.json)",
+    )
+    p_diff.add_argument("--no-save", action="store_true", help="Do not update the stored snapshot")
+    p_diff.add_argument(
+        "--buffered",
+        action="store_true",
+        help="Decode each response page in one shot (orjson when installed) instead of streaming results",
+    )
+    p_diff.set_defaults(func=cmd_diff, workspace_paths=("state_path",), workspace_stream=True)
+
+    p_export = sub.add_parser("export", help="Stream task snapshots into gzip-compressed NDJSON or CSV")
+    export_source = p_export.add_mutually_exclusive_group(required=True)
+    export_source.add_argument("--data-source-id", action="append", help="Notion data source UUID (repeatable)")
+    export_source.add_argument(
+        "--all-projects",
+        action="store_true",
+        help="Export every project TODO data source under the 项目 page",
+    )
+    export_source.add_argument("--resume", action="store_true", help="Resume from <output>.checkpoint.json")
+    p_export.add_argument("--output", required=True, help="Output file path (gzip-compressed)")
+    p_export.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson", help="Row format")
+    p_export.add_argument("--status-property", default="状态", help="Status property name")
+    p_export.add_argument("--title-property", default="任务", help="Title property name")
+    p_export.add_argument("--tags-property", default="标签", help="Tags multi_select property name")
+    p_export.add_argument("--page-size", type=int, default=100, help="Query page size (1-100)")
+    p_export.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=DEFAULT_EXPORT_CHECKPOINT_EVERY,
+        help="Commit output and checkpoint after this many result pages",
+    )
+    p_export.add_argument("--notion-version", help="Notion-Version header")
+    p_export.add_argument("--access-token", help="Explicit bearer token")
+    p_export.set_defaults(func=cmd_export, workspace_paths=("output",))
+
     p_comment = sub.add_parser("create-comment", help="Create a page comment via comments API")
     p_comment.add_argument("--page-id", required=True, help="Notion page UUID")
     comment_source = p_comment.add_mutually_exclusive_group(required=True)
@@ -865,20 +3342,134 @@ def build_parser() -> argparse.ArgumentParser:
     comment_source.add_argument("--stdin", action="store_true", help="Read comment content from stdin")
     p_comment.add_argument("--notion-version", help="Notion-Version header")
     p_comment.add_argument("--access-token", help="Explicit bearer token")
+    add_outbox_arguments(p_comment, "a hash of page id + comment text")
     p_comment.set_defaults(func=cmd_create_comment)
 
+    p_status = sub.add_parser("update-status", help="Set a task page status property")
+    p_status.add_argument("--page-id", required=True, help="Notion page UUID")
+    p_status.add_argument("--status", required=True, help="Status option name, e.g. 已完成")
+    p_status.add_argument("--status-property", default="状态", help="Status property name")
+    p_status.add_argument("--notion-version", help="Notion-Version header")
+    p_status.add_argument("--access-token", help="Explicit bearer token")
+    add_outbox_arguments(p_status, "a random key")
+    p_status.set_defaults(func=cmd_update_status)
+
+    p_flush = sub.add_parser("flush", help="Deliver queued outbox writes in rate-limited batches")
+    p_flush.add_argument("--max-items", type=int, default=100, help="Max writes to attempt per pass")
+    p_flush.add_argument("--rate", type=float, default=DEFAULT_OUTBOX_RATE, help="Max writes per second (0 = no cap)")
+    p_flush.add_argument(
+        "--max-attempts",
+        type=int,
+        default=DEFAULT_OUTBOX_MAX_ATTEMPTS,
+        help="Give up on a write after this many transient failures",
+    )
+    p_flush.add_argument(
+        "--until-empty",
+        action="store_true",
+        help="Keep flushing (waiting out retry backoff) until the queue is empty or --timeout elapses",
+    )
+    p_flush.add_argument(
+        "--timeout",
+        type=int,
+        default=DEFAULT_OUTBOX_FLUSH_TIMEOUT_SECONDS,
+        help="Upper bound in seconds for --until-empty, including waiting for a running flush",
+    )
+    p_flush.add_argument(
+        "--lock-wait",
+        type=float,
+        help="Seconds to wait for a running flush (default: --timeout with --until-empty, else 0)",
+    )
+    p_flush.add_argument(
+        "--ack",
+        type=int,
+        action="append",
+        metavar="ID",
+        help="Acknowledge a failed write (repeatable) so it is no longer listed in failures",
+    )
+    p_flush.add_argument("--access-token", help="Explicit bearer token")
+    p_flush.set_defaults(func=cmd_flush)
+
+    p_tags = sub.add_parser("tags", help="Tag vocabulary, usage counts, suggestions and remaining capacity")
+    p_tags.add_argument("--data-source-id", required=True, help="Notion data source UUID")
+    p_tags.add_argument("--tags-property", default="标签", help="Tags multi_select property name")
+    p_tags.add_argument(
+        "--max-tags",
+        type=int,
+        help="Tag type cap (default: cached GLOBAL_CONFIG max_tags, else 15; always clamped to 1..15)",
+    )
+    p_tags.add_argument("--text", action="append", help="Task title/summary to suggest tags for (repeatable)")
+    p_tags.add_argument("--suggest", type=int, default=DEFAULT_TAG_SUGGESTIONS, help="Suggestions per --text")
+    p_tags.add_argument("--rebuild", action="store_true", help="Discard the local index and rescan every page")
+    p_tags.add_argument(
+        "--reconcile-after",
+        type=int,
+        default=DEFAULT_TAG_INDEX_RECONCILE_SECONDS,
+        help="Rescan every page (dropping trashed ones) once the last full scan is this many seconds old",
+    )
+    p_tags.add_argument("--notion-version", help="Notion-Version header")
+    p_tags.add_argument("--access-token", help="Explicit bearer token")
+    p_tags.set_defaults(func=cmd_tags)
+
+    p_bench = sub.add_parser("bench", help="Benchmark parse/simplify/group on recorded or synthetic responses")
+    p_bench.add_argument("--input", help="Recorded query responses (JSON object, JSON list, or NDJSON)")
+    p_bench.add_argument("--pages", type=int, default=DEFAULT_BENCH_PAGES, help="Synthetic page count")
+    p_bench.add_argument("--rich-text-nodes", type=int, default=8, help="Synthetic rich_text nodes per title")
+    p_bench.add_argument("--repeat", type=int, default=DEFAULT_BENCH_REPEAT, help="Timing repetitions (best-of)")
+    p_bench.add_argument("--baseline", help="Baseline file (default: NPT_CONFIG_DIR/bench-baseline.json)")
+    p_bench.add_argument("--save-baseline", action="store_true", help="Store current numbers as the baseline")
+    p_bench.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_BENCH_TOLERANCE,
+        help="Allowed slowdown/growth ratio before a metric counts as a regression",
+    )
+    p_bench.set_defaults(workspace_scope="none", func=cmd_bench)
+
+    p_ws_add = sub.add_parser("workspace-add", help="Register or update a named workspace")
+    p_ws_add.add_argument("--name", required=True, help="Workspace name")
+    p_ws_add.add_argument("--token-env", help="Environment variable holding the workspace integration token")
+    p_ws_add.add_argument("--rate-limit", type=float, help="Requests/s budget for this workspace (0 = unlimited)")
+    p_ws_add.add_argument("--rate-burst", type=float, help="Burst size for this workspace")
+    p_ws_add.set_defaults(workspace_scope="none", func=cmd_workspace_add)
+
+    p_ws_list = sub.add_parser("workspace-list", help="List registered workspaces")
+    p_ws_list.set_defaults(workspace_scope="none", func=cmd_workspace_list)
+
+    p_ws_remove = sub.add_parser("workspace-remove", help="Remove a workspace from the registry")
+    p_ws_remove.add_argument("--name", required=True, help="Workspace name")
+    p_ws_remove.set_defaults(workspace_scope="none", func=cmd_workspace_remove)
+
     return parser
 
 
 def main() -> int:
     parser = build_parser()
     args = parser.parse_args()
-    store = TokenStore()
+    workspaces = parse_workspace_names(args.workspace)
+    scope = getattr(args, "workspace_scope", "session")
+    if scope == "store" and len(workspaces) > 1:
+        raise NptError(f"{args.command} accepts a single --workspace")
+    store = TokenStore(workspaces[0] if scope == "store" and workspaces else None)
     if hasattr(args, "page_size") and args.page_size:
         if args.page_size < 1 or args.page_size > 100:
             raise NptError("--page-size must be between 1 and 100")
+
+    def run() -> None:
+        if scope == "session" and workspaces:
+            shared = len(workspaces) > 1
+            run_in_workspaces(
+                workspaces,
+                lambda: args.func(workspace_args(args, shared), store),
+                stream=getattr(args, "workspace_stream", False),
+            )
+        else:
+            args.func(args, store)
+
     try:
-        args.func(args, store)
+        if args.profile:
+            run_with_profile(args.profile, args.profile_output, run)
+        else:
+            run()
     except HttpError as exc:
         raise NptError(str(exc)) from exc
     return 0
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Load test for the cross-process rate limiter in notion_api.py.
+
+Starts a local stand-in server that enforces a Notion-style token bucket
+(answering 429 when exceeded), then runs N concurrent helper processes that
+share one bearer token and call `request_json` against it. For each process
+count it reports aggregate throughput and the number of 429 responses.
+
+Example:
+  python3 rate_limit_loadtest.py --processes 1 2 4 8 --requests 15 --rate 3
+  python3 rate_limit_loadtest.py --no-limiter   # baseline without the shared bucket
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.server
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+import notion_api  # noqa: E402
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, rate: float, burst: float):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def admit(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    server: StandInServer
+
+    def do_POST(self) -> None:  # noqa: N802
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.server.admit():
+            status, body = 200, {"object": "list", "results": [], "has_more": False}
+        else:
+            status, body = 429, {"object": "error", "code": "rate_limited"}
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, fmt: str, *args: Any) -> None:  # noqa: A003
+        return
+
+
+def worker(url: str, requests: int, results: "multiprocessing.Queue[Dict[str, int]]") -> None:
+    headers = {"Authorization": "Bearer loadtest-token", "Notion-Version": notion_api.DEFAULT_NOTION_VERSION}
+    ok = limited = 0
+    for _ in range(requests):
+        try:
+            notion_api.request_json("POST", url, headers=headers, body={"page_size": 1})
+            ok += 1
+        except notion_api.HttpError as exc:
+            if exc.status != 429:
+                raise
+            limited += 1
+    results.put({"ok": ok, "limited": limited})
+
+
+def run_round(url: str, processes: int, requests: int) -> Dict[str, Any]:
+    results: "multiprocessing.Queue[Dict[str, int]]" = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker, args=(url, requests, results)) for _ in range(processes)]
+    started = time.monotonic()
+    for proc in procs:
+        proc.start()
+    collected: List[Dict[str, int]] = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    elapsed = time.monotonic() - started
+    ok = sum(item["ok"] for item in collected)
+    limited = sum(item["limited"] for item in collected)
+    return {
+        "processes": processes,
+        "requests": ok + limited,
+        "ok": ok,
+        "rate_limited": limited,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cross-process rate limiter load test")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8], help="Process counts to test")
+    parser.add_argument("--requests", type=int, default=15, help="Requests per process")
+    parser.add_argument("--rate", type=float, default=notion_api.DEFAULT_RATE_LIMIT, help="Allowed requests/s")
+    parser.add_argument("--burst", type=float, default=notion_api.DEFAULT_RATE_BURST, help="Client bucket size")
+    parser.add_argument(
+        "--server-burst",
+        type=float,
+        help="Server bucket size (default: --burst, i.e. no headroom beyond the client bucket)",
+    )
+    parser.add_argument("--no-limiter", action="store_true", help="Disable the shared limiter (baseline)")
+    args = parser.parse_args()
+    server_burst = args.server_burst if args.server_burst is not None else args.burst
+
+    with tempfile.TemporaryDirectory(prefix="npt-ratelimit-") as tmp:
+        os.environ["NPT_RATE_LIMIT_DIR"] = tmp
+        os.environ["NPT_RATE_LIMIT"] = "0" if args.no_limiter else str(args.rate)
+        os.environ["NPT_RATE_BURST"] = str(args.burst)
+        server = StandInServer(args.rate, server_burst)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f"http://127.0.0.1:{server.server_port}/v1/data_sources/loadtest/query"
+        rounds = []
+        for count in args.processes:
+            # Let the server bucket refill so rounds are independent.
+            time.sleep(server_burst / args.rate)
+            rounds.append(run_round(url, count, args.requests))
+        server.shutdown()
+        server.server_close()
+
+    print(
+        json.dumps(
+            {"limiter": not args.no_limiter, "server_rate": args.rate, "server_burst": server_burst, "rounds": rounds},
+            indent=2,
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())